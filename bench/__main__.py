@@ -0,0 +1,175 @@
+"""
+Offline load test of polling, dedup and delivery.
+
+    python -m bench --users 10,1000,50000 --duration 30 --latency 0.2 --tweet-rate 0.01
+
+Every scenario gets a fresh temporary store, tracks N users in one chat and runs
+XManager.work, the production polling loop, against FakeAPI for a fixed wall
+clock time, with new tweets going through the real Notifier into FakeBot.
+Reported per scenario: polls and X requests per second, how late polls started
+after their users were due (schedule lag), users still overdue at the end,
+tweets delivered, end-to-end delivery latency, CPU time and peak RSS. Each
+scenario runs in a process of its own, so its peak RSS is not the one of a
+larger scenario before it.
+
+The request budget is --requests-per-window per account and 15 minute window.
+The default is far above X's real quota so the bot's own overhead shows; pass
+the production value to see the schedule lag the budget alone causes.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fakes import FakeAPI, FakeBot
+from bot import db
+from bot.db import JsonStore, get_subscribers
+from bot.db_sqlite import SqliteStore
+from bot.metrics import POLL_LAG, POLLS_TOTAL
+from bot.notifier import Notifier
+from bot.proxy_pool import ProxyPool
+from bot.x_parser import XManager, XParser
+
+CHAT_ID = 1
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def open_store(backend: str, tmp: Path):
+    if backend == "sqlite":
+        return SqliteStore(tmp / "storage.sqlite3", tmp / "db.json")
+    return JsonStore(tmp / "db.json", tmp / "db.journal")
+
+
+async def run_scenario(users: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        db.use_store(open_store(args.backend, tmp))
+        with db.batch():
+            for user_id in range(1, users + 1):
+                db.add_user(f"user{user_id}", user_id)
+                db.subscribe(CHAT_ID, user_id)
+
+        api = FakeAPI(args.accounts, args.latency, args.error_rate, args.tweet_rate)
+        bot = FakeBot(args.telegram_latency)
+        notifier = Notifier(chat_rate=args.telegram_rate, global_rate=args.telegram_rate)
+        notifier.start(bot)
+
+        (tmp / "proxies.txt").touch()
+        (tmp / "accounts.txt").touch()
+        x_parser = XParser(ProxyPool(tmp / "proxies.txt"), api=api, accounts_file=tmp / "accounts.txt")
+        x_manager = XManager(
+            x_parser,
+            interval_sec=args.interval,
+            concurrency=args.concurrency,
+            requests_per_account_window=args.requests_per_window,
+            # Nothing was polled before, there is nothing to catch up on
+            backfill_horizon_sec=0,
+        )
+
+        async def on_new_tweet(user_id, tweets):
+            notifier.notify(get_subscribers(user_id), tweets)
+
+        x_manager.on_new_tweet_cb = on_new_tweet
+
+        # Keep every schedule lag the loop observes, the histogram only has buckets
+        schedule_lags = []
+        observe = POLL_LAG.observe
+        POLL_LAG.observe = lambda value, **labels: (schedule_lags.append(value), observe(value, **labels))
+        polls_before = POLLS_TOTAL.total()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        x_manager.is_active = True
+        task = asyncio.create_task(x_manager.work())
+        try:
+            await asyncio.sleep(args.duration)
+            if task.done():
+                task.result()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            del POLL_LAG.observe
+        elapsed = time.perf_counter() - started
+        polls = POLLS_TOTAL.total() - polls_before
+        overdue = x_manager.scheduler.due_count()
+
+        # Let the notifier finish what the last polls queued
+        deadline = time.time() + 60
+        while notifier.queue_depth() and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(args.telegram_latency * 2)
+        await notifier.stop()
+        cpu = time.process_time() - cpu_started
+        db.close_db()
+
+    lags = bot.delivery_lags
+    return {
+        "users": users,
+        "polls_per_s": polls / elapsed,
+        "req_per_s": api.requests / elapsed,
+        "sched_p50_s": percentile(schedule_lags, 0.5),
+        "sched_p95_s": percentile(schedule_lags, 0.95),
+        "overdue": overdue,
+        "delivered": len(lags),
+        "messages": bot.messages,
+        "lag_p50_s": percentile(lags, 0.5),
+        "lag_p95_s": percentile(lags, 0.95),
+        "cpu_s": cpu,
+        # ru_maxrss is in KiB on Linux, and this process ran only this scenario
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_table(rows: list[dict]):
+    columns = list(rows[0])
+    print("  ".join(f"{column:>11}" for column in columns))
+    for row in rows:
+        print(
+            "  ".join(
+                f"{value:>11.3f}" if isinstance(value, float) else f"{value:>11}" for value in row.values()
+            )
+        )
+
+
+def scenario_process(users: int, args) -> dict:
+    # Injected fetch errors would otherwise flood the report
+    logging.basicConfig(level=logging.ERROR)
+    return asyncio.run(run_scenario(users, args))
+
+
+def main(args):
+    rows = []
+    # ru_maxrss only ever grows, so a process per scenario; this one never runs
+    # a scenario itself, a fork of it starts from just the imports
+    context = multiprocessing.get_context("fork")
+    for users in args.users:
+        print(f"Running {users} users...")
+        with context.Pool(1) as pool:
+            rows.append(pool.apply(scenario_process, (users, args)))
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark with fake X and Telegram")
+    parser.add_argument("--users", type=lambda v: [int(n) for n in v.split(",")], default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds the polling loop runs")
+    parser.add_argument("--interval", type=int, default=10, help="Shortest time between polls of a user")
+    parser.add_argument(
+        "--requests-per-window", type=int, default=5000, help="Request budget per account and 15 minutes"
+    )
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="X request latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--tweet-rate", type=float, default=0.01, help="Tweets per user per second")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-rate", type=float, default=25.0, help="Telegram sends per second")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    main(parser.parse_args())
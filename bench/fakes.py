@@ -0,0 +1,168 @@
+"""
+In-process stand-ins for twscrape's API and aiogram's Bot.
+
+Both only implement what the bot calls, with configurable latency and error
+rates, so XManager, the storage layer and the Notifier can be driven at scale
+without accounts, proxies or a Telegram token.
+"""
+import asyncio
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+
+@dataclass
+class FakeUser:
+    id: int
+    displayname: str
+    protected: bool = False
+
+
+@dataclass
+class FakeMedia:
+    photos: list = field(default_factory=list)
+    videos: list = field(default_factory=list)
+    animated: list = field(default_factory=list)
+
+
+@dataclass
+class FakeTweet:
+    id: int
+    date: datetime
+    user: FakeUser
+    rawContent: str
+    retweetedTweet: object = None
+    quotedTweet: object = None
+    media: FakeMedia = field(default_factory=FakeMedia)
+
+
+# The creation time travels in the text, so FakeBot can measure delivery latency
+STAMP_RE = re.compile(r"\[ts=(\d+\.\d+)\]")
+
+
+class FakePool:
+    def __init__(self, accounts: int):
+        self.accounts = accounts
+
+    async def accounts_info(self):
+        return [
+            {"username": f"acc{i}", "active": True, "total_req": 0, "error_msg": None}
+            for i in range(self.accounts)
+        ]
+
+    async def get_all(self):
+        return []
+
+
+class FakeAPI:
+    """
+    Timeline source where every user posts as a Poisson process of `tweet_rate` per second.
+
+    Each `user_tweets` call sleeps for a random latency around `latency` seconds
+    per page and fails with probability `error_rate`.
+    """
+
+    def __init__(
+        self,
+        accounts: int = 10,
+        latency: float = 0.2,
+        error_rate: float = 0.0,
+        tweet_rate: float = 0.001,
+        page_size: int = 40,
+    ):
+        self.pool = FakePool(accounts)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tweet_rate = tweet_rate
+        self.page_size = page_size
+        self.requests = 0
+        self._timelines: dict[int, list[FakeTweet]] = {}
+        self._last_seen: dict[int, float] = {}
+        self._next_id = 10**18
+
+    def _tweet(self, user_id: int, posted_at: float, stamp: bool = True) -> FakeTweet:
+        self._next_id += 1
+        return FakeTweet(
+            id=self._next_id,
+            date=datetime.fromtimestamp(posted_at, timezone.utc),
+            user=FakeUser(user_id, f"user{user_id}"),
+            rawContent=f"tweet {self._next_id}" + (f" [ts={posted_at:.6f}]" if stamp else ""),
+        )
+
+    def _advance(self, user_id: int):
+        now = time.time()
+        if user_id not in self._timelines:
+            # Every user has posted before, an empty timeline would read as a gone user.
+            # Not stamped, its delivery latency says nothing about the bot.
+            gap = random.expovariate(self.tweet_rate) if self.tweet_rate > 0 else 30 * 86400
+            self._timelines[user_id] = [self._tweet(user_id, now - gap, stamp=False)]
+        timeline = self._timelines[user_id]
+        elapsed = now - self._last_seen.get(user_id, now)
+        self._last_seen[user_id] = now
+        # Poisson arrivals since the previous look at this user
+        posted_at = now - elapsed
+        while self.tweet_rate > 0:
+            posted_at += random.expovariate(self.tweet_rate)
+            if posted_at > now:
+                break
+            timeline.insert(0, self._tweet(user_id, posted_at))
+        del timeline[200:]
+
+    async def _request(self):
+        self.requests += 1
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            raise ConnectionError("fake X error")
+
+    async def user_tweets(self, user_id, limit: int = -1):
+        user_id = int(user_id)
+        await self._request()
+        self._advance(user_id)
+        timeline = self._timelines[user_id]
+        limit = len(timeline) if limit < 0 else min(limit, len(timeline))
+        for i, tweet in enumerate(timeline[:limit]):
+            if i and i % self.page_size == 0:
+                await self._request()
+            yield tweet
+
+    async def user_by_id(self, user_id):
+        await self._request()
+        return FakeUser(int(user_id), f"user{user_id}")
+
+    async def user_by_login(self, username: str):
+        await self._request()
+        return FakeUser(abs(hash(username)) % 10**12, username)
+
+
+class FakeBot:
+    """Records every send with its time and the delivery latency of the tweets in it."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.messages = 0
+        self.delivery_lags: list[float] = []
+
+    async def _send(self, *texts: str):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            from aiogram.exceptions import TelegramNetworkError
+
+            raise TelegramNetworkError(method=None, message="fake Telegram error")
+        now = time.time()
+        self.messages += 1
+        for text in texts:
+            self.delivery_lags += [now - float(ts) for ts in STAMP_RE.findall(text or "")]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._send(text)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await self._send(caption)
+        return None
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._send(*(item.caption for item in media))
+        return []
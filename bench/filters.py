@@ -0,0 +1,95 @@
+"""
+Filter matching benchmark, failing when regex matching scales with the rule count.
+
+    python -m bench.filters --rules 10,100,1000,5000 --tweets 2000
+
+Every scenario compiles N regex rules and N keyword rules built from a random
+vocabulary and matches the same synthetic tweets against them. Reported per
+scenario: mean time per tweet through the Matcher and through a plain loop
+running every regex, for reference. Exits with status 1 if the Matcher's time
+per tweet at the largest N is over --max-ms, or grows more than --max-growth
+times from the smallest N.
+"""
+import argparse
+import random
+import re
+import string
+import sys
+import time
+
+from bench.__main__ import print_table
+from bot.filters import REGEX_FLAGS, Matcher, normalize_keyword
+
+# Shapes of the regex rules, {} is a vocabulary word
+REGEX_SHAPES = [r"\b{}\b", r"{}\s*\d+", r"\${}\b", r"#{}\w*", r"{} (?:is|was) (?:up|down)"]
+
+
+def make_rules(n: int, vocabulary: list[str], rng: random.Random):
+    words = rng.sample(vocabulary, n)
+    regexes = {rng.choice(REGEX_SHAPES).format(word): [i] for i, word in enumerate(words)}
+    keywords = {normalize_keyword(word): [n + i] for i, word in enumerate(rng.sample(vocabulary, n))}
+    return keywords, regexes
+
+
+def make_tweets(count: int, vocabulary: list[str], rng: random.Random) -> list[str]:
+    tweets = []
+    for _ in range(count):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(10, 40))]
+        words += [str(rng.randint(0, 999)), f"${rng.choice(vocabulary)}", f"#{rng.choice(vocabulary)}"]
+        rng.shuffle(words)
+        tweets.append(" ".join(words))
+    return tweets
+
+
+def per_tweet_ms(fn, tweets: list[str]) -> float:
+    started = time.perf_counter()
+    for text in tweets:
+        fn(text)
+    return (time.perf_counter() - started) / len(tweets) * 1000
+
+
+def run_scenario(n: int, tweets: list[str], vocabulary: list[str], rng: random.Random) -> dict:
+    keywords, regexes = make_rules(n, vocabulary, rng)
+    started = time.perf_counter()
+    matcher = Matcher(keywords, regexes)
+    compile_s = time.perf_counter() - started
+    compiled = [re.compile(pattern, REGEX_FLAGS) for pattern in regexes]
+    return {
+        "rules": n,
+        "compile_s": compile_s,
+        "matcher_ms": per_tweet_ms(matcher.match, tweets),
+        "loop_ms": per_tweet_ms(lambda text: [r.search(text) for r in compiled], tweets),
+    }
+
+
+def main(args) -> int:
+    rng = random.Random(args.seed)
+    vocabulary = list(
+        {"".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(max(args.rules) * 3)}
+    )
+    tweets = make_tweets(args.tweets, vocabulary, rng)
+    rows = [run_scenario(n, tweets, vocabulary, rng) for n in sorted(args.rules)]
+    print_table(rows)
+
+    failures = []
+    smallest, largest = rows[0]["matcher_ms"], rows[-1]["matcher_ms"]
+    if largest > args.max_ms:
+        failures.append(f"{largest:.3f} ms per tweet at {rows[-1]['rules']} rules, over {args.max_ms} ms")
+    if largest > smallest * args.max_growth:
+        failures.append(
+            f"time per tweet grew {largest / smallest:.1f}x from {rows[0]['rules']} to "
+            f"{rows[-1]['rules']} rules, over {args.max_growth}x"
+        )
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter matching benchmark")
+    parser.add_argument("--rules", type=lambda v: [int(n) for n in v.split(",")], default=[10, 100, 1000])
+    parser.add_argument("--tweets", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-ms", type=float, default=1.0, help="Budget per tweet at the largest rule count")
+    parser.add_argument("--max-growth", type=float, default=10.0, help="Allowed growth from the smallest rule count")
+    sys.exit(main(parser.parse_args()))
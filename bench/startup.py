@@ -0,0 +1,141 @@
+"""
+Startup benchmark, failing when a phase takes longer than its budget.
+
+    python -m bench.startup --runs 5 --users 10000 --proxies 1000
+
+Two measurements:
+
+- import: `import bot.__main__` in a fresh interpreter against a temporary store.
+  aiogram is imported first and reported on its own, it is most of the time and
+  out of our hands; the rest up to the "state loaded" phase of bot.startup is
+  the bot's own share. twscrape must not be imported on the way, it loads on
+  first use;
+- first poll: a restart with N tracked users, M proxies with saved scores and an
+  account pool that is already usable, timed from XManager.active() to the first
+  finished poll against FakeAPI.
+
+Exits with status 1 if the median of a phase is over its --max-* budget.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.__main__ import open_store, print_table
+from bench.fakes import FakeAPI
+from bot import db
+from bot.proxy_pool import ProxyPool
+from bot.x_parser import XManager, XParser
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SCRIPT = """
+import json, sys, time
+from bot import startup
+import aiogram.types
+aiogram_s = time.perf_counter() - startup.STARTED
+from bot import db
+from bot.db import JsonStore
+db.use_store(JsonStore(sys.argv[1] + "/db.json", sys.argv[1] + "/db.journal"))
+import bot.__main__
+print(json.dumps({**startup.phases, "aiogram": aiogram_s, "twscrape": "twscrape" in sys.modules}))
+"""
+
+
+def measure_import(tmp: Path) -> dict:
+    env = {**os.environ, "ARCHIVE_DIR": str(tmp / "archive"), "BOT_TOKEN": "0:bench"}
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, str(tmp)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+async def measure_first_poll(tmp: Path, args) -> float:
+    db.use_store(open_store(args.backend, tmp))
+    now = time.time()
+    proxies = [f"10.0.{i // 250}.{i % 250 + 1}:8080" for i in range(args.proxies)]
+    (tmp / "proxies.txt").write_text("\n".join(proxies))
+    (tmp / "accounts.txt").touch()
+    with db.batch():
+        for user_id in range(1, args.users + 1):
+            db.add_user(f"user{user_id}", user_id)
+            # Polled before the restart
+            db.update_poll_state(user_id, last_tweet_id=1, first_polled_at=now - 86400)
+        for proxy in proxies:
+            db.get_store().put("proxy_stats", proxy, {"latency": 0.5, "success_rate": 1.0, "checked_at": now})
+
+    started = time.perf_counter()
+    api = FakeAPI(args.accounts, args.latency, tweet_rate=0)
+    x_parser = XParser(ProxyPool(tmp / "proxies.txt"), api=api, accounts_file=tmp / "accounts.txt")
+    x_manager = XManager(x_parser, interval_sec=1)
+    task = asyncio.create_task(x_manager.active())
+    try:
+        while not x_manager.polls_done:
+            if task.done():
+                task.result()
+                raise RuntimeError("Parser stopped before the first poll")
+            await asyncio.sleep(0.001)
+        return time.perf_counter() - started
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        db.close_db()
+
+
+async def main(args) -> int:
+    rows = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            phases = measure_import(Path(tmp))
+        with tempfile.TemporaryDirectory() as tmp:
+            first_poll = await measure_first_poll(Path(tmp), args)
+        rows.append(
+            {
+                "run": run + 1,
+                "aiogram_s": phases["aiogram"],
+                "bot_init_s": phases["state loaded"] - phases["aiogram"],
+                "first_poll_s": first_poll,
+                "twscrape": "yes" if phases["twscrape"] else "no",
+            }
+        )
+    print_table(rows)
+
+    failures = []
+    for column, budget in (
+        ("bot_init_s", args.max_bot_init),
+        ("first_poll_s", args.max_first_poll),
+    ):
+        median = statistics.median(row[column] for row in rows)
+        if median > budget:
+            failures.append(f"{column}: median {median:.3f}s over the {budget:.3f}s budget")
+    if any(row["twscrape"] == "yes" for row in rows):
+        failures.append("twscrape was imported before it was needed")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Startup benchmark with fake X")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--proxies", type=int, default=1000)
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="X request latency, seconds")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--max-bot-init", type=float, default=0.5, help="Budget of the bot's share of the import")
+    parser.add_argument("--max-first-poll", type=float, default=2.0, help="Budget from activation to first poll")
+    sys.exit(asyncio.run(main(parser.parse_args())))
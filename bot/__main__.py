@@ -1,30 +1,101 @@
 import asyncio
+import html
 import logging
 import sys
+from typing import TYPE_CHECKING
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
-from dotenv import load_dotenv
-from twscrape import Tweet
-from bot.proxy import get_active_proxies
-from bot.db import get_db, save_db
-from bot.loader import PARSING_INTERVAL_SEC, TOKEN
-from bot.proxy import check_proxy
-from bot.utils import extract_username, get_command_args
+from bot import startup
+from bot.db import (
+    adopt_unsubscribed_users,
+    add_filter,
+    add_user,
+    batch as db_batch,
+    cache_user_ids,
+    close_db,
+    delete_filter,
+    delete_user,
+    get_chat_filters,
+    get_chat_usernames,
+    get_store,
+    get_subscribers,
+    get_user_id,
+    get_users,
+    subscribe,
+    unsubscribe,
+    update_poll_state,
+)
+from bot.archive import TweetArchive
+from bot.breakers import BreakerBoard
+from bot.filters import FilterEngine, describe_rule, validate_rule
+from bot.lists import XLists
+from bot.loader import (
+    ARCHIVE_COMPRESSION,
+    METRICS_HOST,
+    METRICS_PORT,
+    PARSING_INTERVAL_SEC,
+    SHARDED,
+    TOKEN,
+    X_LISTS,
+)
+from bot.media import MediaCache
+from bot.metrics import NOTIFY_QUEUE_DEPTH, start_http_server, stats_text
+from bot.notifier import Notifier
+from bot.proxy import proxy_host
+from bot.proxy_pool import ProxyPool
+from bot.shard import OutboxPump
+from bot.supervisor import Supervisor
+from bot.utils import extract_username, get_command_args, parse_usernames
 from bot.x_parser import XManager, XParser
 
-# Load environment variables from .env file
-load_dotenv()
-
+if TYPE_CHECKING:
+    from twscrape import Tweet
 
 logging.basicConfig(level=logging.INFO)
+startup.mark("imports")
 
 
 dp = Dispatcher()
-x_parser = XParser()
-x_manager = XManager(x_parser, int(PARSING_INTERVAL_SEC))
+proxy_pool = ProxyPool()
+# Workers keep their own archives in sharded mode
+archive = TweetArchive() if ARCHIVE_COMPRESSION != "off" and not SHARDED else None
+x_parser = XParser(proxy_pool, archive=archive)
+# file_ids of media sent before survive restarts
+notifier = Notifier(media_cache=MediaCache())
+filters = FilterEngine()
+NOTIFY_QUEUE_DEPTH.fn = notifier.queue_depth
+# List polling is single-process only, workers poll their shards user by user
+x_lists = XLists(lambda: x_parser.api) if X_LISTS and not SHARDED else None
+x_manager = XManager(x_parser, int(PARSING_INTERVAL_SEC), lists=x_lists)
+# Background services owned by the application, not by the handler that started them
+parser_service = Supervisor("Parser")
+outbox_service = Supervisor("Outbox")
+
+
+async def on_new_tweet(user_id, tweets: "list[Tweet]"):
+    for chat_ids, matching in filters.route(user_id, get_subscribers(user_id), tweets):
+        notifier.notify(chat_ids, matching)
+
+
+x_manager.on_new_tweet_cb = on_new_tweet
+startup.mark("state loaded")
+
+
+def start_parser(bot: Bot, chat_id: int) -> bool:
+    """Start polling under the supervisor, reporting problems to `chat_id`. False if it already runs."""
+
+    async def on_run_out_of_proxies(not_enough_proxies=None):
+        await bot.send_message(chat_id, f"❌ Out of proxies. Need at lease {not_enough_proxies} proxies.")
+
+    return parser_service.start(lambda: x_manager.active(on_run_out_of_proxies=on_run_out_of_proxies))
+
+
+@dp.startup()
+async def on_startup():
+    startup.mark("answering commands")
 
 
 # Handler for /start command
@@ -42,13 +113,23 @@ async def send_help(message: types.Message):
         🔹 <b>/start</b> - Start the bot and get a welcome message.
         🔹 <b>/help</b> - Show this help message with all available commands.
         🔹 <b>/check_proxy &lt;proxy&gt;</b> - Check proxies.
-        🔹 <b>/users</b> - List all tracked Twitter users.
-        🔹 <b>/add_user &lt;username or URL&gt;</b> - Add a Twitter user to track.
-           Example: <code>/add_user elonmusk</code> or <code>/add_user https://twitter.com/elonmusk</code>
+        🔹 <b>/users</b> - List the Twitter users tracked in this chat.
+        🔹 <b>/add_user &lt;username or URL&gt; ...</b> - Add Twitter users to track in this chat.
+           Example: <code>/add_user elonmusk</code> or <code>/add_user https://twitter.com/elonmusk nasa</code>
+           Send a .txt file with /add_user as caption to import a whole list.
         🔹 <b>/delete_user &lt;username or URL&gt;</b> - Remove a tracked Twitter user.
            Example: <code>/delete_user elonmusk</code>
-        🔹 <b>/activate_parser</b> - Start the parser to monitor tweets from tracked users.
+        🔹 <b>/pin_user &lt;username&gt; &lt;seconds&gt;</b> - Poll a user at a fixed interval.
+        🔹 <b>/unpin_user &lt;username&gt;</b> - Go back to adaptive polling for a user.
+        🔹 <b>/add_filter [@username] &lt;keyword or /regex/&gt;</b> - Only forward matching tweets.
+           Example: <code>/add_filter $TSLA</code> or <code>/add_filter @elonmusk /star(ship|link)/</code>
+        🔹 <b>/filters</b> - List this chat's filters.
+        🔹 <b>/delete_filter &lt;id&gt;</b> - Remove a filter.
+        🔹 <b>/activate_parser</b> - Start the parser to monitor tweets from tracked users, also after restarts.
         🔹 <b>/stop_parser</b> - Stop the tweet parser.
+        🔹 <b>/status</b> - Parser state, restarts and last error.
+        🔹 <b>/breakers</b> - Users, accounts and proxies benched after repeated failures.
+        🔹 <b>/stats</b> - Poll, delivery and storage timings.
     """
     await message.reply(help_text)
 
@@ -59,7 +140,7 @@ async def _(message: types.Message):
     proxy = await get_command_args(message)
     await message.reply(f"Adding proxy {proxy}...")
 
-    if await check_proxy(proxy):
+    if await proxy_pool.probe_one(proxy):
         x_manager.set_proxy(proxy)
         await message.answer(
             f"✅ Parser set to use proxy {proxy}... Need to /activate_parser"
@@ -71,95 +152,299 @@ async def _(message: types.Message):
 # USERS
 @dp.message(Command("users"))
 async def _(message: types.Message):
-    # Extract proxy details from command arguments
-    db = get_db()
-    await message.reply(f"Users: {"\n".join(db['users'])}\n")
+    await message.reply(f"Users: {"\n".join(get_chat_usernames(message.chat.id))}\n")
 
 
 @dp.message(Command("add_user"))
 async def _(message: types.Message):
-    db = get_db()
-    username = await get_command_args(message)
-    username = username.replace("@", "") 
-    if username in db["users"].keys():
-        await message.reply(f"User {username} already exists!")
+    # Usernames may follow the command (any number, one per line or space
+    # separated) or come in a .txt file sent with /add_user as its caption
+    text = (message.text or message.caption or "").split(maxsplit=1)
+    usernames = parse_usernames(text[1] if len(text) > 1 else "")
+    if message.document:
+        file = await message.bot.download(message.document)
+        usernames += [u for u in parse_usernames(file.read().decode(errors="ignore")) if u not in usernames]
+    if not usernames:
+        await message.reply("Please provide usernames, e.g. /add_user elonmusk nasa")
         return
-    x_user_id = await x_manager.x_parser.get_user_id_by_username(username)
-    db["users"][username] = x_user_id
-    save_db(db)
 
-    await message.reply(f"✅ Adding user {username}...")
+    if len(usernames) > 1:
+        await message.reply(f"Resolving {len(usernames)} users...")
+    resolved, failed = await x_manager.x_parser.resolve_user_ids(usernames)
+
+    tracked = get_users()
+    added, existing = [], []
+    # One commit for the whole list, however long
+    with db_batch():
+        cache_user_ids(resolved)
+        for username, x_user_id in resolved.items():
+            if username in tracked and message.chat.id in get_subscribers(x_user_id):
+                existing.append(username)
+                continue
+            if username not in tracked:
+                # Other chats may follow the user already, it is only fetched once
+                add_user(username, x_user_id)
+            subscribe(message.chat.id, x_user_id)
+            added.append(username)
+    if added:
+        x_manager.sync_lists()
+
+    if len(usernames) == 1 and not failed:
+        if existing:
+            await message.reply(f"User {usernames[0]} already exists!")
+        else:
+            await message.reply(f"✅ Adding user {usernames[0]}...")
+        return
+    summary = f"✅ Added {len(added)} users"
+    if existing:
+        summary += f", {len(existing)} already tracked"
+    if failed:
+        summary += f"\n❌ Could not resolve: {', '.join(failed)}"
+    await message.reply(summary)
 
 
 @dp.message(Command("delete_user"))
 async def _(message: types.Message):
-    db = get_db()
     username = await get_command_args(message)
     username = username.replace("@", "")
-    try:
-        del db["users"][username]
-    except KeyError:
+    x_user_id = get_user_id(username)
+    if x_user_id is None:
         await message.reply(f"User {username} does not exist!")
         return
-    save_db(db)
+    if not unsubscribe(message.chat.id, x_user_id) and get_subscribers(x_user_id):
+        await message.reply(f"User {username} is not tracked in this chat!")
+        return
+    # Stop fetching the user once no chat follows it any more
+    if not get_subscribers(x_user_id):
+        delete_user(username)
+        x_manager.sync_lists()
     await message.reply(f"✅ Deleting user {username}...")
 
 
+@dp.message(Command("pin_user"))
+async def _(message: types.Message):
+    args = message.text.split()[1:]
+    try:
+        username, interval_sec = args[0].replace("@", ""), int(args[1])
+    except (IndexError, ValueError):
+        await message.reply("Usage: /pin_user <username> <seconds>")
+        return
+    user_id = get_user_id(username)
+    if user_id is None:
+        await message.reply(f"User {username} does not exist!")
+        return
+    # Faster than the minimum would bypass the request budget's spacing
+    low, high = x_manager.scheduler.min_interval_sec, x_manager.scheduler.max_interval_sec
+    if not low <= interval_sec <= high:
+        await message.reply(f"The interval must be between {low:g} and {high:g} seconds")
+        return
+    update_poll_state(user_id, pinned_interval_sec=interval_sec)
+    await message.reply(f"✅ Polling {username} every {interval_sec}s")
+
+
+@dp.message(Command("unpin_user"))
+async def _(message: types.Message):
+    args = message.text.split()[1:]
+    if len(args) != 1:
+        await message.reply("Usage: /unpin_user <username>")
+        return
+    username = args[0].replace("@", "")
+    user_id = get_user_id(username)
+    if user_id is None:
+        await message.reply(f"User {username} does not exist!")
+        return
+    update_poll_state(user_id, pinned_interval_sec=None)
+    await message.reply(f"✅ Polling {username} adaptively")
+
+
+# FILTERS
+@dp.message(Command("add_filter"))
+async def _(message: types.Message):
+    text = message.text.split(maxsplit=1)
+    args = text[1].strip() if len(text) > 1 else ""
+    user_id = None
+    if args.startswith("@"):
+        username, _, args = args.partition(" ")
+        username = username[1:]
+        user_id = get_user_id(username)
+        if user_id is None or message.chat.id not in get_subscribers(user_id):
+            await message.reply(f"User {username} is not tracked in this chat!")
+            return
+        args = args.strip()
+
+    if len(args) > 2 and args.startswith("/") and args.endswith("/"):
+        rule = {"kind": "regex", "pattern": args[1:-1], "user_id": user_id}
+    else:
+        rule = {"kind": "keyword", "pattern": args, "user_id": user_id}
+    try:
+        validate_rule(rule)
+    except ValueError as e:
+        await message.reply(f"❌ {html.escape(str(e))}\nUsage: /add_filter [@username] <keyword or /regex/>")
+        return
+    rule_id = add_filter(message.chat.id, rule)
+    await message.reply(f"✅ Filter #{rule_id} added, only matching tweets are forwarded")
+
+
+@dp.message(Command("filters"))
+async def _(message: types.Message):
+    rules = get_chat_filters(message.chat.id)
+    if not rules:
+        await message.reply("No filters, every tweet is forwarded.")
+        return
+    usernames = {int(user_id): username for username, user_id in get_users().items()}
+    await message.reply(html.escape("\n".join(describe_rule(rule, usernames) for rule in rules)))
+
+
+@dp.message(Command("delete_filter"))
+async def _(message: types.Message):
+    text = message.text.split(maxsplit=1)
+    try:
+        rule_id = int(text[1].strip().lstrip("#"))
+    except (IndexError, ValueError):
+        await message.reply("Usage: /delete_filter <id>")
+        return
+    if not delete_filter(message.chat.id, rule_id):
+        await message.reply(f"Filter #{rule_id} does not exist!")
+        return
+    await message.reply(f"✅ Filter #{rule_id} deleted")
+
+
 # management
 @dp.message(Command("activate_parser"))
 async def _(message: types.Message):
-    await message.reply("✅ Activating parser...")
+    # Users added before per-chat subscriptions go to the chat that starts the parser
+    adopt_unsubscribed_users(message.chat.id)
+    if SHARDED:
+        await message.reply("Polling runs in the worker processes (python -m bot.worker).")
+        return
 
-    async def on_run_out_of_proxies(not_enough_proxies=None):
-        await message.answer(f"❌ Out of proxies. Need at lease {not_enough_proxies} proxies.")
-
-    async def on_new_tweet(tweets: list[Tweet]):
-        for tweet in tweets:
-            from_name = tweet.user.displayname
-            tweet_type = "📝 Tweet"
-            if tweet.retweetedTweet:
-                tweet_type = "🎥🔄 Retweet"
-            if tweet.quotedTweet:
-                tweet_type = "💬 Quote"
-            msg = f"""
-{tweet_type} by {from_name}:\n
-{tweet.rawContent}\n
-            """
-            try:
-                photo_url = tweet.media.photos[0].url
-            except Exception:
-                photo_url = None
-            if photo_url:
-                try:
-                    await message.answer_photo(photo_url, caption=msg)
-                except Exception:
-                    await message.answer(msg)
-            else:
-                await message.answer(msg)
-
-    x_manager.on_new_tweet_cb = on_new_tweet
-    await x_manager.active(on_run_out_of_proxies=on_run_out_of_proxies)
+    if not start_parser(message.bot, message.chat.id):
+        await message.reply("Parser is already running, see /status")
+        return
+    # Polling resumes on its own after a restart until /stop_parser
+    get_store().put("services", "parser", {"chat_id": message.chat.id})
+    await message.reply("✅ Activating parser...")
 
 
 # management
 @dp.message(Command("check_proxy"))
 async def _(message: types.Message):
-    proxies = await get_active_proxies()
-    await message.reply(f"✅ Good Proxies: {len(proxies)}")
+    summary = proxy_pool.summary()
+    best = "\n".join(
+        f"{proxy.split(':')[0]}: {proxy_pool.stats[proxy].latency:.2f}s"
+        for proxy in proxy_pool.best(5)
+        if proxy_pool.stats[proxy].latency is not None
+    )
+    await message.reply(
+        f"✅ Good Proxies: {summary['healthy']}/{summary['total']}\n"
+        f"Quarantined: {summary['quarantined']}, not checked yet: {summary['unchecked']}\n"
+        f"{best}"
+    )
+
+@dp.message(Command("breakers"))
+async def _(message: types.Message):
+    usernames = {str(user_id): username for username, user_id in get_users().items()}
+    if SHARDED:
+        # The workers' breakers, as saved in the shared db; this process polls nothing itself
+        boards = BreakerBoard("user"), BreakerBoard("account"), BreakerBoard("proxy")
+    else:
+        boards = x_manager.breakers, x_parser.account_breakers, proxy_pool.breakers
+    lines = []
+    for title, board, name in zip(
+        ("Users", "Accounts", "Proxies"),
+        boards,
+        (lambda key: usernames.get(key, key), str, proxy_host),
+    ):
+        tripped = board.tripped()
+        if not tripped:
+            continue
+        lines.append(f"{title}:")
+        for key, breaker in sorted(tripped.items(), key=lambda item: item[1]["open_until"]):
+            retry_in = int(board.retry_in(key))
+            lines.append(
+                f"  {name(key)}: {breaker['state']}, retry in {retry_in}s, "
+                f"{breaker['failures']} failures ({breaker.get('error') or 'unknown'})"
+            )
+    await message.reply(html.escape("\n".join(lines)) if lines else "✅ No open breakers")
+
+
+@dp.message(Command("stats"))
+async def _(message: types.Message):
+    text = stats_text()
+    if SHARDED:
+        # Polling runs in the workers, their numbers are not in this process
+        text = f"This process only: delivery is counted, polling is done by the workers\n\n{text}"
+    await message.reply(f"<pre>{html.escape(text)}</pre>")
+
 
 # management
 @dp.message(Command("stop_parser"))
 async def _(message: types.Message):
-    await message.reply("✅ Stopping parser...")
     await x_manager.stop()
+    get_store().delete("services", "parser")
+    if await parser_service.stop():
+        await message.reply("✅ Parser stopped")
+    else:
+        await message.reply("Parser is not running")
+
+
+@dp.message(Command("status"))
+async def _(message: types.Message):
+    services = [outbox_service] if SHARDED else [parser_service]
+    lines = [service.status() for service in services]
+    if parser_service.running:
+        scheduler = x_manager.scheduler
+        lines.append(
+            f"Users: {len(scheduler)} tracked, {scheduler.due_count()} overdue"
+            + (", catching up after downtime" if x_manager.backfilling else "")
+        )
+        lines.append(f"Budget: {x_manager.budget.rate * 60:.1f} req/min")
+    summary = proxy_pool.summary()
+    lines.append(f"Proxies: {summary['healthy']}/{summary['total']} healthy")
+    lines.append(f"Notifications queued: {notifier.queue_depth()}")
+    lines.append(f"Startup: {startup.summary()}")
+    await message.reply(html.escape("\n".join(lines)))
 
 
 async def main() -> None:
+    if SHARDED:
+        from bot.db_sqlite import SqliteStore
+
+        # The outbox the workers write to lives in the shared SQLite db
+        if not isinstance(get_store(), SqliteStore):
+            sys.exit("Sharded mode needs the shared SQLite db, set DB_BACKEND=sqlite")
     # Initialize Bot instance with default bot properties which will be passed to all API calls
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+    notifier.start(bot)
+    if METRICS_PORT:
+        await start_http_server(METRICS_PORT, METRICS_HOST)
+    if SHARDED:
+        # Workers do the polling, this process only relays their notifications
+        outbox_service.start(OutboxPump(get_store(), notifier).run)
+    else:
+        proxy_pool.start()
+        resume = get_store().get("services", "parser")
+        if resume is not None:
+            logging.info("Resuming the parser, it was running before the restart")
+            start_parser(bot, resume["chat_id"])
+    warm_up = None
+    if archive is not None:
+        # Open the archive index and check its last segment off the event loop, not on the first poll
+        warm_up = asyncio.create_task(asyncio.to_thread(archive.load))
     # And the run events dispatching
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await parser_service.stop()
+        await outbox_service.stop()
+        await notifier.stop()
+        await proxy_pool.stop()
+        if warm_up is not None:
+            await asyncio.gather(warm_up, return_exceptions=True)
+        if archive is not None:
+            archive.close()
+        close_db()
 
 
 if __name__ == "__main__":
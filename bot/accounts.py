@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from bot.loader import ACCOUNTS_FILE
+from bot.proxy import proxy_host, proxy_url
+from bot.proxy_pool import ProxyPool
+
+if TYPE_CHECKING:
+    from twscrape import API
+
+
+def read_accounts_file(path: Path = ACCOUNTS_FILE) -> list[dict]:
+    """
+    Parse accounts.txt, one `username:password:email:email_password:ct0:auth_token` per line.
+    """
+    accounts = []
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                # Skip empty lines
+                if not line.strip():
+                    continue
+
+                parts = line.strip().split(":")
+                if len(parts) < 6:
+                    print(f"Skipping invalid account line: {line.strip()}")
+                    continue
+
+                accounts.append(
+                    {
+                        "username": parts[0],
+                        "password": parts[1],
+                        "email": parts[2],
+                        "email_password": parts[3],
+                        "cookies": {"ct0": parts[4], "auth_token": parts[5]},
+                    }
+                )
+    except FileNotFoundError:
+        print(f"Account file not found: {path}")
+    return accounts
+
+
+async def sync_account_pool(api: API, proxy_pool: ProxyPool, path: Path = ACCOUNTS_FILE) -> dict:
+    """
+    Bring twscrape's accounts.db in line with accounts.txt without re-adding everything.
+
+    Accounts already in the pool are only saved when their credentials changed or
+    their proxy stopped being healthy. Proxies are sticky: an account keeps the one
+    stored in accounts.db while the proxy pool considers it healthy, and only
+    accounts without a usable proxy get a free one, lowest latency first. With
+    no free proxy left an account keeps its unhealthy one rather than going
+    direct, and is counted as without a proxy.
+
+    Returns:
+        dict: Counts of added, updated and unchanged accounts and of accounts left without a proxy
+    """
+    existing = {account.username: account for account in await api.pool.get_all()}
+    raw_by_url = {proxy_url(proxy): proxy for proxy in proxy_pool.stats}
+
+    def healthy_proxy(account) -> str | None:
+        raw = raw_by_url.get(account.proxy) if account.proxy else None
+        return raw if raw and proxy_pool.is_healthy(raw) else None
+
+    taken = {healthy_proxy(account) for account in existing.values()} - {None}
+    free = [proxy for proxy in proxy_pool.best() if proxy not in taken]
+
+    summary = {"added": 0, "updated": 0, "unchanged": 0, "without_proxy": 0}
+    for entry in read_accounts_file(path):
+        account = existing.get(entry["username"])
+
+        if account is None:
+            proxy = free.pop(0) if free else None
+            await api.pool.add_account(
+                username=entry["username"],
+                password=entry["password"],
+                email=entry["email"],
+                email_password=entry["email_password"],
+                cookies="; ".join(f"{k}={v}" for k, v in entry["cookies"].items()),
+                proxy=proxy_url(proxy) if proxy else None,
+            )
+            summary["added"] += 1
+            if proxy is None:
+                logging.warning(f"No free proxy for new account {entry['username']}, it connects directly")
+                summary["without_proxy"] += 1
+            continue
+
+        changed = False
+        if any(account.cookies.get(k) != v for k, v in entry["cookies"].items()):
+            # Fresh cookies, give a previously failing account another chance
+            account.cookies = {**account.cookies, **entry["cookies"]}
+            account.active = True
+            account.error_msg = None
+            changed = True
+        for field in ("password", "email", "email_password"):
+            if getattr(account, field) != entry[field]:
+                setattr(account, field, entry[field])
+                changed = True
+
+        if healthy_proxy(account) is None:
+            if free:
+                proxy = free.pop(0)
+                logging.info(f"Moving account {account.username} to proxy {proxy_host(proxy)}")
+                account.proxy = proxy_url(proxy)
+                changed = True
+            else:
+                # Going direct would expose the server's IP, the old proxy may recover
+                kept = "keeping its current one" if account.proxy else "it connects directly"
+                logging.warning(f"No healthy free proxy for account {account.username}, {kept}")
+                summary["without_proxy"] += 1
+
+        if changed:
+            await api.pool.save(account)
+            summary["updated"] += 1
+        else:
+            summary["unchanged"] += 1
+
+    logging.info(f"Account pool synced: {summary}")
+    return summary
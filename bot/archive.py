@@ -0,0 +1,310 @@
+"""
+Append-only archive of every fetched tweet.
+
+Tweets are stored as orjson lines in compressed segments under ARCHIVE_DIR:
+
+    tweets-000001.jsonl.gz   concatenated gzip (or zstd) members, one per block
+    index.sqlite3            tweet_id, user_id -> segment, block offset, block length
+
+A block holds up to `block_tweets` tweets and is compressed on its own, so a
+single tweet or a user's history is read back by decompressing only the blocks
+the index points at. The active segment is rotated past `segment_bytes`.
+The index stays on disk, lookups are indexed queries and nothing of the
+history is held in memory; new tweets are deduplicated against the ids
+archived recently, the index ignores any older duplicate.
+
+Indexes written as tweets-000001.idx files by earlier versions are imported
+into index.sqlite3 on first open.
+
+    python -m bot.archive tweet <tweet_id>
+    python -m bot.archive user <user_id> [limit]
+"""
+import dataclasses
+import gzip
+import itertools
+import logging
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+import orjson
+
+from bot.loader import (
+    ARCHIVE_BLOCK_TWEETS,
+    ARCHIVE_COMPRESSION,
+    ARCHIVE_DIR,
+    ARCHIVE_FLUSH_SEC,
+    ARCHIVE_SEGMENT_MB,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Legacy .idx record: tweet_id, user_id, offset of the block in the segment, compressed block length
+INDEX_RECORD = struct.Struct("<QQII")
+# Archived ids kept in memory for deduplication
+RECENT_IDS = 100_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweets (
+    tweet_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tweets_user ON tweets (user_id, tweet_id);
+"""
+
+
+class _Gzip:
+    suffix = ".jsonl.gz"
+
+    def compress(self, data: bytes) -> bytes:
+        # mtime=0 keeps identical blocks byte-identical
+        return gzip.compress(data, compresslevel=6, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class _Zstd:
+    suffix = ".jsonl.zst"
+
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=10)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+def _codec(name: str):
+    if name == "zstd":
+        if zstandard is not None:
+            return _Zstd()
+        logging.warning("ARCHIVE_COMPRESSION=zstd but zstandard is not installed, using gzip")
+    return _Gzip()
+
+
+def tweet_to_dict(tweet) -> dict:
+    # twscrape models are dataclasses; datetimes are serialized by orjson
+    return dataclasses.asdict(tweet) if dataclasses.is_dataclass(tweet) else dict(tweet)
+
+
+class TweetArchive:
+    def __init__(
+        self,
+        directory: Path = ARCHIVE_DIR,
+        compression: str = ARCHIVE_COMPRESSION,
+        segment_bytes: int = ARCHIVE_SEGMENT_MB * 1024 * 1024,
+        block_tweets: int = ARCHIVE_BLOCK_TWEETS,
+        flush_sec: float = ARCHIVE_FLUSH_SEC,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.codec = _codec(compression)
+        # The index is 32 bit offsets, a segment must stay below 4 GiB
+        self.segment_bytes = min(segment_bytes, 2**32 - 1)
+        self.block_tweets = block_tweets
+        self.flush_sec = flush_sec
+        # Tweets waiting to be compressed into the next block
+        self._pending: dict[int, tuple[int, bytes]] = {}
+        self._pending_since = 0.0
+        # Ids archived lately, oldest first; older duplicates are left to the index
+        self._recent: dict[int, None] = {}
+        self.segment = 0
+        self._data = None
+        self._db: sqlite3.Connection | None = None
+        # Opening checks the active segment against the index, done on first write
+        # or lookup, or ahead of it by load()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def _paths(self, segment: int) -> tuple[Path, Path]:
+        stem = self.directory / f"tweets-{segment:06d}"
+        return stem.with_name(stem.name + self.codec.suffix), stem.with_suffix(".idx")
+
+    def load(self):
+        """Open the index and the active segment, if not done yet. Safe to run in a thread."""
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self):
+        # Used from the event loop after a warm-up in a thread, the lock keeps it to one at a time
+        self._db = sqlite3.connect(self.directory / "index.sqlite3", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._import_legacy_indexes()
+
+        segments = [int(path.name.split("-")[1].split(".")[0]) for path in self.directory.glob("tweets-*.jsonl.*")]
+        segment = max(segments + [self._db.execute("SELECT MAX(segment) FROM tweets").fetchone()[0] or 1])
+        data_path, _ = self._paths(segment)
+        # A crash may leave a block whose index rows never made it
+        end = self._db.execute(
+            "SELECT MAX(offset + length) FROM tweets WHERE segment = ?", (segment,)
+        ).fetchone()[0] or 0
+        if data_path.exists() and data_path.stat().st_size > end:
+            logging.warning(f"Archive segment {data_path.name}: dropping an unindexed tail")
+            with open(data_path, "r+b") as f:
+                f.truncate(end)
+        self._open_segment(segment)
+
+    def _import_legacy_indexes(self):
+        for index_path in sorted(self.directory.glob("tweets-*.idx")):
+            segment = int(index_path.stem.split("-")[1])
+            raw = index_path.read_bytes()
+            # A crash may have left half a record
+            whole = len(raw) - len(raw) % INDEX_RECORD.size
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO tweets VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (tweet_id, user_id, segment, offset, length)
+                        for tweet_id, user_id, offset, length in INDEX_RECORD.iter_unpack(raw[:whole])
+                    ),
+                )
+            logging.info(f"Archive: imported {index_path.name} into the index")
+            index_path.unlink()
+
+    def _open_segment(self, segment: int):
+        self.close_files()
+        self.segment = segment
+        data_path, _ = self._paths(segment)
+        self._data = open(data_path, "ab")
+
+    def __len__(self):
+        if not self._loaded:
+            self.load()
+        return self._db.execute("SELECT COUNT(*) FROM tweets").fetchone()[0] + len(self._pending)
+
+    def __contains__(self, tweet_id) -> bool:
+        if not self._loaded:
+            self.load()
+        tweet_id = int(tweet_id)
+        if tweet_id in self._pending:
+            return True
+        return self._db.execute("SELECT 1 FROM tweets WHERE tweet_id = ?", (tweet_id,)).fetchone() is not None
+
+    def append(self, tweets: list):
+        """Queue tweets not archived lately, writing a block once enough piled up."""
+        for tweet in tweets:
+            if int(tweet.id) in self._pending or int(tweet.id) in self._recent:
+                continue
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending[int(tweet.id)] = (int(tweet.user.id), orjson.dumps(tweet_to_dict(tweet)))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if len(self._pending) >= self.block_tweets or (
+            self._pending and time.monotonic() - self._pending_since >= self.flush_sec
+        ):
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        if not self._loaded:
+            self.load()
+        if self._data.tell() >= self.segment_bytes:
+            self._open_segment(self.segment + 1)
+
+        block = self.codec.compress(b"\n".join(line for _, line in self._pending.values()) + b"\n")
+        offset = self._data.tell()
+        self._data.write(block)
+        self._data.flush()
+        # Data goes first, a block is only visible once its rows are committed
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tweets VALUES (?, ?, ?, ?, ?)",
+                (
+                    (tweet_id, user_id, self.segment, offset, len(block))
+                    for tweet_id, (user_id, _) in self._pending.items()
+                ),
+            )
+        for tweet_id in self._pending:
+            self._recent[tweet_id] = None
+        for tweet_id in list(itertools.islice(self._recent, max(len(self._recent) - RECENT_IDS, 0))):
+            del self._recent[tweet_id]
+        self._pending = {}
+
+    def _read_block(self, location: tuple[int, int, int]) -> list[dict]:
+        segment, offset, length = location
+        data_path, _ = self._paths(segment)
+        with open(data_path, "rb") as f:
+            f.seek(offset)
+            block = self.codec.decompress(f.read(length))
+        return [orjson.loads(line) for line in block.splitlines()]
+
+    def get(self, tweet_id) -> dict | None:
+        if not self._loaded:
+            self.load()
+        tweet_id = int(tweet_id)
+        if tweet_id in self._pending:
+            return orjson.loads(self._pending[tweet_id][1])
+        location = self._db.execute(
+            "SELECT segment, offset, length FROM tweets WHERE tweet_id = ?", (tweet_id,)
+        ).fetchone()
+        if location is None:
+            return None
+        return next((t for t in self._read_block(location) if int(t["id"]) == tweet_id), None)
+
+    def user_history(self, user_id, limit: int | None = None) -> list[dict]:
+        """Archived tweets of `user_id`, newest first."""
+        if not self._loaded:
+            self.load()
+        user_id = int(user_id)
+        tweets = [orjson.loads(line) for uid, line in self._pending.values() if uid == user_id]
+        # Blocks newest first, each read once however many of the user's tweets it holds
+        blocks = self._db.execute(
+            "SELECT segment, offset, length FROM tweets WHERE user_id = ? ORDER BY tweet_id DESC",
+            (user_id,),
+        )
+        seen_blocks = set()
+        for location in blocks:
+            if limit is not None and len(tweets) >= limit:
+                break
+            if location in seen_blocks:
+                continue
+            seen_blocks.add(location)
+            tweets += [t for t in self._read_block(location) if int(t["user"]["id"]) == user_id]
+        tweets.sort(key=lambda t: int(t["id"]), reverse=True)
+        return tweets if limit is None else tweets[:limit]
+
+    def close_files(self):
+        if self._data is not None:
+            self._data.close()
+        self._data = None
+
+    def close(self):
+        self.flush()
+        self.close_files()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            self._loaded = False
+
+
+if __name__ == "__main__":
+    archive = TweetArchive()
+    if sys.argv[1:2] == ["tweet"] and len(sys.argv) == 3:
+        tweet = archive.get(sys.argv[2])
+        print(orjson.dumps(tweet, option=orjson.OPT_INDENT_2).decode() if tweet else "Not archived")
+    elif sys.argv[1:2] == ["user"] and len(sys.argv) in (3, 4):
+        limit = int(sys.argv[3]) if len(sys.argv) == 4 else None
+        for tweet in archive.user_history(sys.argv[2], limit):
+            print(orjson.dumps(tweet).decode())
+    else:
+        print("Usage: python -m bot.archive tweet <tweet_id> | user <user_id> [limit]")
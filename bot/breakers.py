@@ -0,0 +1,119 @@
+import random
+import time
+
+from bot.db import get_store
+from bot.loader import BREAKER_BASE_SEC, BREAKER_MAX_SEC, BREAKER_THRESHOLD
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BreakerBoard:
+    """
+    Circuit breakers for one kind of thing (users, accounts, proxies), keyed by id.
+
+    A breaker opens after `threshold` failures in a row and stays open for an
+    exponential, jittered backoff that grows with every re-open. Once that is
+    over, `allow()` lets a single trial through (half-open): a success closes
+    the breaker, a failure opens it again for longer. Breakers that are not
+    closed are persisted, so a restart does not hammer broken entries again.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        threshold: int = BREAKER_THRESHOLD,
+        base_sec: float = BREAKER_BASE_SEC,
+        max_sec: float = BREAKER_MAX_SEC,
+    ):
+        self.kind = kind
+        self.ns = f"breaker_{kind}"
+        self.threshold = threshold
+        self.base_sec = base_sec
+        self.max_sec = max_sec
+        # key -> {"state", "failures", "opens", "open_until", "error"}; closed breakers
+        # without failures are not kept
+        self.breakers: dict[str, dict] = dict(get_store().items(self.ns))
+
+    def _save(self, key: str, breaker: dict | None):
+        store = get_store()
+        if breaker is None:
+            self.breakers.pop(key, None)
+            store.delete(self.ns, key)
+        else:
+            self.breakers[key] = breaker
+            # Failures below the threshold are not worth a write
+            if breaker["state"] != CLOSED:
+                store.put(self.ns, key, breaker)
+
+    def state(self, key) -> str:
+        breaker = self.breakers.get(str(key))
+        if breaker is None:
+            return CLOSED
+        if breaker["state"] == OPEN and time.time() >= breaker["open_until"]:
+            return HALF_OPEN
+        return breaker["state"]
+
+    def retry_in(self, key) -> float:
+        """Seconds until an open breaker lets a trial through."""
+        breaker = self.breakers.get(str(key))
+        if breaker is None or breaker["state"] == CLOSED:
+            return 0.0
+        return max(breaker["open_until"] - time.time(), 0.0)
+
+    def allow(self, key) -> bool:
+        """Whether `key` may be used now; an expired open breaker turns half-open for one trial."""
+        key = str(key)
+        breaker = self.breakers.get(key)
+        if breaker is None or breaker["state"] == CLOSED:
+            return True
+        now = time.time()
+        if now < breaker["open_until"]:
+            return False
+        # One trial at a time; a trial whose outcome never came in is retried after base_sec
+        self._save(key, {**breaker, "state": HALF_OPEN, "open_until": now + self.base_sec})
+        return True
+
+    def success(self, key):
+        key = str(key)
+        if key in self.breakers:
+            self._save(key, None)
+
+    def reload(self, keys):
+        """Read the saved breakers of `keys` again, e.g. of users another worker polled until now."""
+        keys = {str(key) for key in keys}
+        if not keys:
+            return
+        for key, breaker in get_store().items(self.ns).items():
+            if key in keys:
+                self.breakers[key] = breaker
+
+    def forget(self, keys):
+        """Drop breakers from memory only, their saved state is left to whoever else uses them."""
+        for key in keys:
+            self.breakers.pop(str(key), None)
+
+    def failure(self, key, error: str = ""):
+        key = str(key)
+        breaker = self.breakers.get(key) or {"state": CLOSED, "failures": 0, "opens": 0, "open_until": 0}
+        failures = breaker["failures"] + 1
+        if breaker["state"] == CLOSED and failures < self.threshold:
+            self._save(key, {**breaker, "failures": failures, "error": error})
+            return
+        opens = breaker["opens"] + 1
+        backoff = min(self.base_sec * 2 ** (opens - 1), self.max_sec) * random.uniform(0.8, 1.2)
+        self._save(
+            key,
+            {
+                "state": OPEN,
+                "failures": failures,
+                "opens": opens,
+                "open_until": time.time() + backoff,
+                "error": error,
+            },
+        )
+
+    def tripped(self) -> dict[str, dict]:
+        """Breakers that are open or half-open."""
+        return {key: breaker for key, breaker in self.breakers.items() if breaker["state"] != CLOSED}
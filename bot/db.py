@@ -1,34 +1,396 @@
+from __future__ import annotations
+
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import orjson
-from twscrape import Tweet
 
-from bot.loader import DB_FILE
+from bot.loader import (
+    DB_BACKEND,
+    DB_COMPACT_EVERY,
+    DB_FILE,
+    DB_JOURNAL_FILE,
+    SEEN_TWEETS_PER_USER,
+)
+from bot.metrics import DB_SECONDS, timed
+
+if TYPE_CHECKING:
+    from twscrape import Tweet
+
+# Bucket for ids saved before tweets were tracked per user, checked for everyone
+LEGACY_SEEN_KEY = "*"
+
+
+class SeenTweets:
+    """Newest announced tweet ids per user, bounded to `per_user` ids each."""
+
+    def __init__(self, per_user: int = SEEN_TWEETS_PER_USER):
+        self.per_user = per_user
+        # dicts keep insertion order, so the first key is always the oldest id
+        self._by_user: dict[str, dict[int, None]] = {}
+
+    @classmethod
+    def from_db(cls, data: dict, per_user: int = SEEN_TWEETS_PER_USER) -> "SeenTweets":
+        seen = cls(per_user)
+        if data.get("tweets"):
+            seen.add(LEGACY_SEEN_KEY, data["tweets"])
+        for user_id, tweet_ids in data.get("seen", {}).items():
+            seen.add(user_id, tweet_ids)
+        return seen
+
+    def to_db(self) -> dict[str, list[int]]:
+        return {user_id: list(ids) for user_id, ids in self._by_user.items()}
+
+    def is_seen(self, user_id, tweet_id: int) -> bool:
+        return tweet_id in self._by_user.get(str(user_id), ()) or tweet_id in self._by_user.get(
+            LEGACY_SEEN_KEY, ()
+        )
+
+    def add(self, user_id, tweet_ids: list[int]):
+        seen = self._by_user.setdefault(str(user_id), {})
+        for tweet_id in tweet_ids:
+            seen.pop(tweet_id, None)
+            seen[tweet_id] = None
+        while len(seen) > self.per_user:
+            del seen[next(iter(seen))]
+
+
+class JsonStore:
+    """
+    db.json kept resident in memory.
+
+    Every change is appended to a journal file first and the full snapshot is only
+    rewritten (atomically, via a temp file) once `compact_every` entries piled up.
+    On start the snapshot is loaded and the journal replayed on top of it.
+    """
+
+    def __init__(
+        self,
+        path: Path = DB_FILE,
+        journal_path: Path = DB_JOURNAL_FILE,
+        compact_every: int = DB_COMPACT_EVERY,
+    ):
+        self.path = Path(path)
+        self.journal_path = Path(journal_path)
+        self.compact_every = compact_every
+
+        self.data = {"users": {}}
+        if self.path.exists():
+            self.data = orjson.loads(self.path.read_bytes())
+        self.seen = SeenTweets.from_db(self.data)
+
+        replayed, torn = self._replay()
+        self._batch: list[dict] | None = None
+        self._journal = open(self.journal_path, "ab")
+        self._pending = replayed
+        if torn or replayed >= self.compact_every:
+            self.compact()
+
+    def _replay(self) -> tuple[int, bool]:
+        if not self.journal_path.exists():
+            return 0, False
+        replayed, torn = 0, False
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # A crash in the middle of an append leaves a partial last line
+                    logging.warning(f"Skipping torn journal entry in {self.journal_path}")
+                    torn = True
+                    continue
+                self._apply(entry)
+                replayed += 1
+        return replayed, torn
+
+    def _apply(self, entry: dict):
+        op = entry["op"]
+        if op == "set":
+            self.data.setdefault(entry["ns"], {})[entry["key"]] = entry["value"]
+        elif op == "del":
+            self.data.get(entry["ns"], {}).pop(entry["key"], None)
+        elif op == "seen":
+            self.seen.add(entry["key"], entry["ids"])
+
+    def write(self, entries: list[dict]):
+        if not entries:
+            return
+        for entry in entries:
+            self._apply(entry)
+        if self._batch is not None:
+            self._batch += entries
+            return
+        self._journal.write(b"".join(orjson.dumps(entry) + b"\n" for entry in entries))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+        self._pending += len(entries)
+        if self._pending >= self.compact_every:
+            self.compact()
+
+    @contextmanager
+    def batch(self):
+        """Group writes into a single journal append and fsync."""
+        if self._batch is not None:
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+        finally:
+            entries, self._batch = self._batch, None
+            self.write(entries)
+
+    def compact(self):
+        self.data.pop("tweets", None)
+        self.data["seen"] = self.seen.to_db()
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(self.data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # Entries are idempotent, so a crash before this truncate only replays them twice
+        self._journal.close()
+        self._journal = open(self.journal_path, "wb")
+        self._pending = 0
+
+    def close(self):
+        if self._pending:
+            self.compact()
+        self._journal.close()
+
+    def get(self, ns: str, key: str, default=None):
+        return self.data.get(ns, {}).get(key, default)
+
+    def items(self, ns: str) -> dict:
+        return self.data.get(ns, {})
+
+    def put(self, ns: str, key: str, value):
+        self.write([{"op": "set", "ns": ns, "key": key, "value": value}])
+
+    def delete(self, ns: str, key: str):
+        self.write([{"op": "del", "ns": ns, "key": key}])
+
+    def users(self) -> dict[str, int]:
+        return self.items("users")
+
+    def add_user(self, username: str, user_id):
+        self.put("users", username, user_id)
+
+    def delete_user(self, username: str) -> bool:
+        if username not in self.users():
+            return False
+        self.delete("users", username)
+        return True
+
+    def unseen(self, user_id, tweet_ids: list[int]) -> set[int]:
+        return {tweet_id for tweet_id in tweet_ids if not self.seen.is_seen(user_id, tweet_id)}
+
+    def mark_seen(self, user_id, tweet_ids: list[int]):
+        self.write([{"op": "seen", "key": str(user_id), "ids": tweet_ids}])
+
+    def subscribe(self, chat_id: int, user_id):
+        chats = self.subscribers(user_id)
+        if chat_id not in chats:
+            self.put("subscriptions", str(user_id), chats + [chat_id])
+
+    def unsubscribe(self, chat_id: int, user_id) -> bool:
+        chats = self.subscribers(user_id)
+        if chat_id not in chats:
+            return False
+        chats.remove(chat_id)
+        if chats:
+            self.put("subscriptions", str(user_id), chats)
+        else:
+            self.delete("subscriptions", str(user_id))
+        return True
+
+    def subscribers(self, user_id) -> list[int]:
+        return list(self.get("subscriptions", str(user_id), []))
+
+    def subscriptions(self, chat_id: int) -> list[int]:
+        return [
+            int(user_id)
+            for user_id, chats in self.items("subscriptions").items()
+            if chat_id in chats
+        ]
+
+    def get_state(self, user_id) -> dict:
+        return self.get("state", str(user_id), {})
+
+    def update_state(self, user_id, **fields):
+        self.put("state", str(user_id), {**self.get_state(user_id), **fields})
 
 
-def get_db() -> dict:
-    with open(DB_FILE, "rb") as f:
-        return orjson.loads(f.read())
+_store = None
 
 
-def save_db(data: dict):
-    with open(DB_FILE, "wb") as f:
-        f.write(orjson.dumps(data))
+def get_store():
+    """The configured storage backend, opened on first use."""
+    global _store
+    if _store is None:
+        if DB_BACKEND == "sqlite":
+            from bot.db_sqlite import SqliteStore
+
+            _store = SqliteStore()
+        else:
+            _store = JsonStore()
+    return _store
+
+
+def batch():
+    """Context manager committing every change made inside it at once."""
+    return get_store().batch()
+
+
+def use_store(store):
+    """Make `store` the backend behind the module functions, e.g. a temporary one."""
+    global _store
+    close_db()
+    _store = store
+
+
+def close_db():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+@timed(DB_SECONDS, op="get_users")
+def get_users() -> dict[str, int]:
+    return get_store().users()
 
 
 def existing_user_ids() -> list[str]:
-    users = get_db().get("users", [])
-    return [user_id for username, user_id in users.items()]
+    return list(get_users().values())
+
+
+@timed(DB_SECONDS, op="add_user")
+def add_user(username: str, user_id):
+    get_store().add_user(username, user_id)
+
+
+@timed(DB_SECONDS, op="delete_user")
+def delete_user(username: str) -> bool:
+    return get_store().delete_user(username)
+
+
+@timed(DB_SECONDS, op="save_new_tweets")
+def save_new_tweets(user_id, tweets_ids: list[int]):
+    get_store().mark_seen(user_id, tweets_ids)
+
+
+@timed(DB_SECONDS, op="filter_new_tweets")
+def filter_new_tweets(user_id, tweets: list[Tweet]) -> list[Tweet]:
+    unseen = get_store().unseen(user_id, [t.id for t in tweets])
+    return [t for t in tweets if t.id in unseen]
+
+
+@timed(DB_SECONDS, op="get_poll_state")
+def get_poll_state(user_id) -> dict:
+    return get_store().get_state(user_id)
+
+
+@timed(DB_SECONDS, op="update_poll_state")
+def update_poll_state(user_id, **fields):
+    get_store().update_state(user_id, **fields)
+
+
+def get_user_id(username: str):
+    return get_users().get(username)
+
+
+@timed(DB_SECONDS, op="subscribe")
+def subscribe(chat_id: int, user_id):
+    get_store().subscribe(chat_id, user_id)
+
+
+@timed(DB_SECONDS, op="unsubscribe")
+def unsubscribe(chat_id: int, user_id) -> bool:
+    return get_store().unsubscribe(chat_id, user_id)
+
+
+@timed(DB_SECONDS, op="get_subscribers")
+def get_subscribers(user_id) -> list[int]:
+    return get_store().subscribers(user_id)
+
+
+def get_chat_usernames(chat_id: int) -> list[str]:
+    """Usernames of the tracked users a chat is subscribed to."""
+    user_ids = set(get_store().subscriptions(chat_id))
+    return [username for username, user_id in get_users().items() if int(user_id) in user_ids]
+
+
+def get_cached_user_ids(usernames: list[str]) -> dict[str, int]:
+    """user_ids already resolved for `usernames`, from tracked users or the lookup cache."""
+    store = get_store()
+    users = get_users()
+    cached = {}
+    for username in usernames:
+        user_id = users.get(username) or store.get("usernames", username.lower())
+        if user_id is not None:
+            cached[username] = user_id
+    return cached
+
+
+def cache_user_ids(user_ids: dict[str, int]):
+    store = get_store()
+    for username, user_id in user_ids.items():
+        store.put("usernames", username.lower(), user_id)
+
+
+def adopt_unsubscribed_users(chat_id: int) -> int:
+    """Subscribe `chat_id` to users added before subscriptions existed."""
+    store = get_store()
+    adopted = 0
+    for user_id in set(existing_user_ids()):
+        if not store.subscribers(user_id):
+            store.subscribe(chat_id, user_id)
+            adopted += 1
+    return adopted
+
+
+def get_filters() -> dict[int, list[dict]]:
+    """Filter rules of every chat, see bot.filters."""
+    return {int(chat_id): rules for chat_id, rules in get_store().items("filters").items()}
+
+
+def get_chat_filters(chat_id: int) -> list[dict]:
+    return get_store().get("filters", str(chat_id), [])
 
 
-def existing_tweets() -> list[str]:
-    return get_db().get("tweets", [])
+def get_filters_version() -> int:
+    """Bumped on every rule change, so other processes know to recompile."""
+    return get_store().get("filters_meta", "version", 0)
 
 
-def save_new_tweets(tweets_ids: list[str]) -> list[str]:
-    data = get_db()
-    data["tweets"] += tweets_ids
-    save_db(data)
+def add_filter(chat_id: int, rule: dict) -> int:
+    store = get_store()
+    rules = get_chat_filters(chat_id)
+    rule_id = max((r["id"] for r in rules), default=0) + 1
+    with store.batch():
+        store.put("filters", str(chat_id), rules + [{**rule, "id": rule_id}])
+        store.put("filters_meta", "version", get_filters_version() + 1)
+    return rule_id
 
 
-def filter_new_tweets(tweets: list[Tweet]) -> list[Tweet]:
-    old_tweets = get_db().get("tweets", [])
-    return [t for t in tweets if t.id not in old_tweets]
+def delete_filter(chat_id: int, rule_id: int) -> bool:
+    store = get_store()
+    rules = get_chat_filters(chat_id)
+    kept = [r for r in rules if r["id"] != rule_id]
+    if len(kept) == len(rules):
+        return False
+    with store.batch():
+        if kept:
+            store.put("filters", str(chat_id), kept)
+        else:
+            store.delete("filters", str(chat_id))
+        store.put("filters_meta", "version", get_filters_version() + 1)
+    return True
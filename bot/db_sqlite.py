@@ -0,0 +1,243 @@
+import logging
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import orjson
+
+from bot.loader import DB_FILE, SEEN_TWEETS_PER_USER, SQLITE_DB_FILE
+
+# Tweet ids migrated from the old flat "tweets" list are stored under this user id
+LEGACY_USER_ID = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_user_id ON users (user_id);
+CREATE TABLE IF NOT EXISTS seen_tweets (
+    user_id INTEGER NOT NULL,
+    tweet_id INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (user_id, tweet_id)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS seen_tweets_seen_at;
+CREATE INDEX IF NOT EXISTS seen_tweets_user_seen_at ON seen_tweets (user_id, seen_at);
+CREATE TABLE IF NOT EXISTS poll_state (
+    user_id INTEGER PRIMARY KEY,
+    last_tweet_id INTEGER,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscriptions_user_id ON subscriptions (user_id);
+CREATE TABLE IF NOT EXISTS kv (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteStore:
+    """
+    Storage backend on a WAL-mode SQLite file.
+
+    Same interface as `bot.db.JsonStore`, but every lookup is an indexed query, so
+    it scales with the number of users and the tweet history, and several
+    processes can share one file. On first open an existing db.json is migrated.
+    Like `bot.db.SeenTweets`, only the newest `seen_per_user` seen ids are kept per user.
+    """
+
+    def __init__(
+        self,
+        path: Path = SQLITE_DB_FILE,
+        json_path: Path = DB_FILE,
+        seen_per_user: int = SEEN_TWEETS_PER_USER,
+    ):
+        self.path = Path(path)
+        self.seen_per_user = seen_per_user
+        self.conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+        if self._meta("migrated_from_json") is None:
+            migrate_json(self, Path(json_path))
+
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    batch = transaction
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, ns: str, key: str, default=None):
+        row = self.conn.execute(
+            "SELECT value FROM kv WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        return orjson.loads(row[0]) if row else default
+
+    def items(self, ns: str) -> dict:
+        rows = self.conn.execute("SELECT key, value FROM kv WHERE ns = ?", (ns,))
+        return {key: orjson.loads(value) for key, value in rows}
+
+    def put(self, ns: str, key: str, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value) VALUES (?, ?, ?)",
+            (ns, key, orjson.dumps(value).decode()),
+        )
+
+    def delete(self, ns: str, key: str):
+        self.conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def users(self) -> dict[str, int]:
+        return dict(self.conn.execute("SELECT username, user_id FROM users ORDER BY username"))
+
+    def add_user(self, username: str, user_id):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO users (username, user_id) VALUES (?, ?)",
+            (username, int(user_id)),
+        )
+
+    def delete_user(self, username: str) -> bool:
+        cursor = self.conn.execute("DELETE FROM users WHERE username = ?", (username,))
+        return cursor.rowcount > 0
+
+    def unseen(self, user_id, tweet_ids: list[int]) -> set[int]:
+        if not tweet_ids:
+            return set()
+        placeholders = ",".join("?" * len(tweet_ids))
+        rows = self.conn.execute(
+            f"SELECT tweet_id FROM seen_tweets WHERE user_id IN (?, ?) AND tweet_id IN ({placeholders})",
+            (int(user_id), LEGACY_USER_ID, *tweet_ids),
+        )
+        return set(tweet_ids) - {tweet_id for (tweet_id,) in rows}
+
+    def mark_seen(self, user_id, tweet_ids: list[int]):
+        now = time.time()
+        with self.transaction():
+            # Seen again counts as newest, as in SeenTweets
+            self.conn.executemany(
+                "INSERT INTO seen_tweets (user_id, tweet_id, seen_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, tweet_id) DO UPDATE SET seen_at = excluded.seen_at",
+                [(int(user_id), tweet_id, now) for tweet_id in tweet_ids],
+            )
+            self.conn.execute(
+                "DELETE FROM seen_tweets WHERE user_id = ? AND tweet_id NOT IN ("
+                "SELECT tweet_id FROM seen_tweets WHERE user_id = ? "
+                "ORDER BY seen_at DESC, tweet_id DESC LIMIT ?)",
+                (int(user_id), int(user_id), self.seen_per_user),
+            )
+
+    def subscribe(self, chat_id: int, user_id):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO subscriptions (chat_id, user_id) VALUES (?, ?)",
+            (chat_id, int(user_id)),
+        )
+
+    def unsubscribe(self, chat_id: int, user_id) -> bool:
+        cursor = self.conn.execute(
+            "DELETE FROM subscriptions WHERE chat_id = ? AND user_id = ?", (chat_id, int(user_id))
+        )
+        return cursor.rowcount > 0
+
+    def subscribers(self, user_id) -> list[int]:
+        rows = self.conn.execute("SELECT chat_id FROM subscriptions WHERE user_id = ?", (int(user_id),))
+        return [chat_id for (chat_id,) in rows]
+
+    def subscriptions(self, chat_id: int) -> list[int]:
+        rows = self.conn.execute("SELECT user_id FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        return [user_id for (user_id,) in rows]
+
+    def get_state(self, user_id) -> dict:
+        row = self.conn.execute(
+            "SELECT data FROM poll_state WHERE user_id = ?", (int(user_id),)
+        ).fetchone()
+        return orjson.loads(row[0]) if row else {}
+
+    def update_state(self, user_id, **fields):
+        with self.transaction():
+            state = {**self.get_state(user_id), **fields}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO poll_state (user_id, last_tweet_id, updated_at, data) "
+                "VALUES (?, ?, ?, ?)",
+                (int(user_id), state.get("last_tweet_id"), time.time(), orjson.dumps(state).decode()),
+            )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, nested uses join the outer transaction."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.owner = False
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.owner = True
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.owner:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def migrate_json(store: SqliteStore, json_path: Path = DB_FILE):
+    """One-shot import of db.json (and its pending journal) into `store`."""
+    from bot.db import LEGACY_SEEN_KEY, JsonStore
+
+    # Its own journal, db.journal belongs to the default db.json only
+    journal_path = json_path.with_suffix(".journal")
+    with store.transaction():
+        if json_path.exists() or journal_path.exists():
+            json_store = JsonStore(json_path, journal_path)
+            for username, user_id in json_store.users().items():
+                store.add_user(username, user_id)
+            for user_id, tweet_ids in json_store.seen.to_db().items():
+                if user_id == LEGACY_SEEN_KEY:
+                    user_id = LEGACY_USER_ID
+                store.mark_seen(user_id, tweet_ids)
+            for user_id, state in json_store.items("state").items():
+                store.update_state(user_id, **state)
+            for user_id, chats in json_store.items("subscriptions").items():
+                for chat_id in chats:
+                    store.subscribe(chat_id, user_id)
+            for ns, values in json_store.data.items():
+                if ns in ("users", "seen", "state", "subscriptions", "tweets"):
+                    continue
+                for key, value in values.items():
+                    store.put(ns, key, value)
+            json_store.close()
+            logging.info(f"Migrated {json_path} into {store.path}")
+
+        store.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (str(json_path),),
+        )
+
+
+if __name__ == "__main__":
+    # python -m bot.db_sqlite migrate -- force a re-import of db.json
+    if sys.argv[1:] == ["migrate"]:
+        logging.basicConfig(level=logging.INFO)
+        migrate_json(SqliteStore())
+    else:
+        print("Usage: python -m bot.db_sqlite migrate")
@@ -0,0 +1,309 @@
+"""
+Per-chat keyword and regex filters for notifications.
+
+A rule is a dict stored per chat by bot.db: {"id", "kind": "keyword" | "regex",
+"pattern", "user_id"}. A rule with a user_id only applies to that user's tweets.
+A chat without rules for a user gets all of that user's tweets. Once it has any,
+only tweets matching at least one of them get through.
+
+All rules of all chats are compiled into one Matcher, so the work per tweet
+follows the rules that can match it rather than how many rules there are:
+
+- keywords (words, phrases, $cashtags, #hashtags) are matched case-insensitively
+  on word boundaries, with whitespace runs counting as one space, through an
+  Aho-Corasick automaton when pyahocorasick is installed or a trie-shaped regex
+  otherwise;
+- regexes are indexed by a literal every match of theirs contains; the
+  literals are found the same way, and only regexes whose literal occurs are
+  run.
+"""
+from __future__ import annotations
+
+import logging
+import re
+# The only way to walk a pattern's structure; stable since Python 3.11
+from re import _parser as sre_parse
+from typing import TYPE_CHECKING
+
+from bot.db import get_filters, get_filters_version
+from bot.metrics import NOTIFICATIONS_FILTERED
+
+if TYPE_CHECKING:
+    from twscrape import Tweet
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Regexes are matched with these flags, rules cannot change them
+REGEX_FLAGS = re.IGNORECASE | re.DOTALL
+MAX_PATTERN_LENGTH = 200
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def normalize_keyword(keyword: str) -> str:
+    """Lowercase with runs of whitespace as one space; keywords and tweet texts both go through it."""
+    return " ".join(keyword.lower().split())
+
+
+# Non-ASCII characters IGNORECASE matches against ASCII letters, mapped to them
+# before literals are looked for, so the prefilter cannot miss a regex match
+_ASCII_FOLD = str.maketrans({"\u0131": "i", "\u0130": "i", "\u017f": "s", "\u212a": "k"})
+
+
+def fold_text(text: str) -> str:
+    return text.translate(_ASCII_FOLD).lower()
+
+
+def validate_rule(rule: dict):
+    """Raise ValueError if `rule` cannot be compiled."""
+    pattern = rule["pattern"]
+    if not pattern or len(pattern) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Pattern must be 1-{MAX_PATTERN_LENGTH} characters")
+    if rule["kind"] == "keyword":
+        return
+    if rule["kind"] != "regex":
+        raise ValueError(f"Unknown rule kind {rule['kind']}")
+    if "(?P<" in pattern:
+        raise ValueError("Named groups are not supported, use (?:...)")
+    if re.search(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]", pattern):
+        raise ValueError("Backreferences and inline flags are not supported")
+    try:
+        re.compile(pattern, REGEX_FLAGS)
+    except re.error as e:
+        raise ValueError(f"Invalid regex: {e}") from None
+
+
+def required_literal(pattern: str) -> str:
+    """
+    Longest ASCII string every match of `pattern` contains, lowercased.
+
+    "" if there is none, e.g. for a top-level alternation. Only mandatory parts
+    of the pattern are looked at: plain characters, groups, and repeats of at
+    least one.
+    """
+
+    def walk(items) -> str:
+        best = run = ""
+        for op, av in items:
+            if op is sre_parse.LITERAL and av < 128:
+                run += chr(av).lower()
+                continue
+            if op is sre_parse.AT:
+                # Anchors take no characters, the literal around them stays contiguous
+                continue
+            best = max(best, run, key=len)
+            run = ""
+            if op is sre_parse.SUBPATTERN:
+                best = max(best, walk(av[-1]), key=len)
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT) and av[0] >= 1:
+                best = max(best, walk(av[2]), key=len)
+            elif op is sre_parse.ATOMIC_GROUP:
+                best = max(best, walk(av), key=len)
+        return max(best, run, key=len)
+
+    try:
+        return walk(sre_parse.parse(pattern, REGEX_FLAGS))
+    except Exception:
+        return ""
+
+
+def _trie_regex(words: list[str]) -> str:
+    """Alternation of `words` shaped like a trie, so matching does not try each word in turn."""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in node.items() if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy, so the longest word wins and shorter ones are found through `prefixes`
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class _Substrings:
+    """
+    Which of a set of strings occur in a text, found in one pass.
+
+    Through an Aho-Corasick automaton when pyahocorasick is installed, a
+    trie-shaped regex otherwise. With `whole_words` only occurrences on word
+    boundaries count.
+    """
+
+    def __init__(self, words, whole_words: bool):
+        self.whole_words = whole_words
+        self.automaton = None
+        self.regex = None
+        # word -> shorter words it starts with, hidden by the longest match at a position
+        self.prefixes: dict[str, list[str]] = {}
+        if not words:
+            return
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for word in words:
+                self.automaton.add_word(word, word)
+            self.automaton.make_automaton()
+            return
+        if whole_words:
+            self.regex = re.compile(rf"(?<!\w)(?=({_trie_regex(list(words))})(?!\w))")
+        else:
+            self.regex = re.compile(f"(?=({_trie_regex(list(words))}))")
+        for word in words:
+            self.prefixes[word] = [
+                word[:i]
+                for i in range(1, len(word))
+                if word[:i] in words and (not whole_words or not _is_word(word[i]))
+            ]
+
+    def find(self, text: str) -> set[str]:
+        if self.automaton is not None:
+            found = set()
+            for end, word in self.automaton.iter(text):
+                start = end - len(word) + 1
+                if not self.whole_words or (
+                    (start == 0 or not _is_word(text[start - 1]))
+                    and (end + 1 == len(text) or not _is_word(text[end + 1]))
+                ):
+                    found.add(word)
+            return found
+        if self.regex is None:
+            return set()
+        found = {match.group(1) for match in self.regex.finditer(text)}
+        return found.union(*(self.prefixes[word] for word in found))
+
+
+class Matcher:
+    """
+    Every keyword and regex, compiled to answer "which rules match this text".
+
+    Keywords are found in one pass. Each regex is indexed by a literal all of
+    its matches contain, and only regexes whose literal occurs in the text
+    (found in one pass too) are run, so the cost follows the rules that can
+    match rather than the number of rules. Regexes without such a literal are
+    always run.
+    """
+
+    def __init__(self, keywords: dict[str, list[int]], regexes: dict[str, list[int]]):
+        self.keywords = keywords
+        self.keyword_index = _Substrings(keywords, whole_words=True)
+
+        # (compiled regex, rule indexes) per distinct pattern
+        self.regexes = [(re.compile(pattern, REGEX_FLAGS), ids) for pattern, ids in regexes.items()]
+        self.by_literal: dict[str, list[int]] = {}
+        self.unindexed: list[int] = []
+        for i, pattern in enumerate(regexes):
+            literal = required_literal(pattern)
+            if literal:
+                self.by_literal.setdefault(literal, []).append(i)
+            else:
+                self.unindexed.append(i)
+        self.literal_index = _Substrings(self.by_literal, whole_words=False)
+
+    def match(self, text: str) -> set[int]:
+        """Indexes of the rules matching `text`."""
+        matched = set()
+        if self.keywords:
+            for keyword in self.keyword_index.find(normalize_keyword(text)):
+                matched.update(self.keywords[keyword])
+        if self.regexes:
+            candidates = set(self.unindexed)
+            for literal in self.literal_index.find(fold_text(text)):
+                candidates.update(self.by_literal[literal])
+            for i in candidates:
+                regex, ids = self.regexes[i]
+                if regex.search(text):
+                    matched.update(ids)
+        return matched
+
+
+class FilterEngine:
+    """Decides which subscribed chats a user's tweets go to, recompiling when rules change."""
+
+    def __init__(self):
+        self.version = None
+        self.matcher = Matcher({}, {})
+        # rule index -> (chat_id, user_id or None)
+        self.owners: list[tuple[int, int | None]] = []
+        # Chats filtering every user, and (chat, user) pairs with user-specific rules
+        self.filtered_chats: set[int] = set()
+        self.filtered_pairs: set[tuple[int, int]] = set()
+
+    def refresh(self):
+        version = get_filters_version()
+        if version != self.version:
+            self.compile(get_filters())
+            self.version = version
+
+    def compile(self, filters: dict[int, list[dict]]):
+        keywords: dict[str, list[int]] = {}
+        regexes: dict[str, list[int]] = {}
+        self.owners = []
+        self.filtered_chats = set()
+        self.filtered_pairs = set()
+        for chat_id, rules in filters.items():
+            for rule in rules:
+                try:
+                    validate_rule(rule)
+                except (KeyError, ValueError) as e:
+                    # Saved before a check existed or got stricter; the other rules must keep working
+                    logging.warning(f"Skipping filter {rule.get('id')} of chat {chat_id}: {e}")
+                    continue
+                index = len(self.owners)
+                user_id = int(rule["user_id"]) if rule.get("user_id") is not None else None
+                self.owners.append((chat_id, user_id))
+                if user_id is None:
+                    self.filtered_chats.add(chat_id)
+                else:
+                    self.filtered_pairs.add((chat_id, user_id))
+                if rule["kind"] == "keyword":
+                    keywords.setdefault(normalize_keyword(rule["pattern"]), []).append(index)
+                else:
+                    regexes.setdefault(rule["pattern"], []).append(index)
+        self.matcher = Matcher(keywords, regexes)
+
+    def is_filtered(self, chat_id: int, user_id: int) -> bool:
+        return chat_id in self.filtered_chats or (chat_id, user_id) in self.filtered_pairs
+
+    def route(self, user_id, chat_ids: list[int], tweets: list[Tweet]) -> list[tuple[list[int], list[Tweet]]]:
+        """
+        Split `tweets` by the chats they may go to.
+
+        Returns (chat_ids, tweets) groups; tweets no chat wants are left out.
+        """
+        self.refresh()
+        user_id = int(user_id)
+        filtered = [chat_id for chat_id in chat_ids if self.is_filtered(chat_id, user_id)]
+        if not filtered:
+            return [(chat_ids, tweets)] if chat_ids and tweets else []
+
+        groups: dict[tuple[int, ...], list[Tweet]] = {}
+        for tweet in tweets:
+            allowed = {
+                chat_id
+                for chat_id, rule_user_id in (self.owners[i] for i in self.matcher.match(tweet.rawContent))
+                if rule_user_id in (None, user_id)
+            }
+            chats = tuple(c for c in chat_ids if c not in filtered or c in allowed)
+            NOTIFICATIONS_FILTERED.inc(len(chat_ids) - len(chats))
+            if chats:
+                groups.setdefault(chats, []).append(tweet)
+        return [(list(chats), group) for chats, group in groups.items()]
+
+
+def describe_rule(rule: dict, usernames: dict[int, str]) -> str:
+    pattern = f"/{rule['pattern']}/" if rule["kind"] == "regex" else rule["pattern"]
+    if rule.get("user_id") is not None:
+        username = usernames.get(int(rule["user_id"]), rule["user_id"])
+        return f"#{rule['id']} @{username}: {pattern}"
+    return f"#{rule['id']}: {pattern}"
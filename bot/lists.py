@@ -0,0 +1,157 @@
+"""
+Batch polling through X Lists.
+
+Tracked users are added to Lists owned by pool accounts (X_LISTS), and one
+`list_timeline` walk then covers up to LIST_MAX_MEMBERS users. Membership is
+stored in the db and kept in line with the tracked users; list ids and their
+owner accounts are configured, the lists themselves are created by hand.
+
+twscrape has no List mutations, so members are added and removed through the
+owner account's own client with the GraphQL ids from the X_GQL_* settings,
+which X changes from time to time.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Callable
+
+from bot.db import get_store
+from bot.loader import (
+    LIST_MAX_MEMBERS,
+    LIST_SYNC_BATCH,
+    X_GQL_LIST_ADD_MEMBER,
+    X_GQL_LIST_REMOVE_MEMBER,
+    X_LISTS,
+)
+
+if TYPE_CHECKING:
+    from twscrape import API, Tweet
+
+GQL_URL = "https://x.com/i/api/graphql/{query_id}/{operation}"
+# Feature switches the web client sends with List mutations
+GQL_FEATURES = {
+    "rweb_lists_timeline_redesign_enabled": True,
+    "responsive_web_graphql_exclude_directive_enabled": True,
+    "verified_phone_label_enabled": False,
+    "responsive_web_graphql_skip_user_profile_image_extensions_enabled": False,
+    "responsive_web_graphql_timeline_navigation_enabled": True,
+}
+
+
+def parse_lists(value: str = X_LISTS) -> dict[int, str]:
+    """X_LISTS, `owner_username:list_id` pairs separated by commas, as list_id -> owner."""
+    lists = {}
+    for entry in value.split(","):
+        owner, _, list_id = entry.strip().partition(":")
+        if owner and list_id.isdigit():
+            lists[int(list_id)] = owner
+        elif entry.strip():
+            logging.warning(f"Skipping invalid X_LISTS entry: {entry}")
+    return lists
+
+
+class XLists:
+    def __init__(
+        self,
+        get_api: Callable[[], API],
+        lists: dict[int, str] | None = None,
+        max_members: int = LIST_MAX_MEMBERS,
+        sync_batch: int = LIST_SYNC_BATCH,
+    ):
+        # Called on use, so building the lists does not build the API
+        self.get_api = get_api
+        self.lists = parse_lists() if lists is None else lists
+        self.max_members = max_members
+        self.sync_batch = sync_batch
+        self._lock = asyncio.Lock()
+
+    def members(self) -> dict[int, dict]:
+        """user_id -> {"list_id", "joined_at"} for every user synced into a list."""
+        return {int(user_id): member for user_id, member in get_store().items("list_members").items()}
+
+    def handles(self, member: dict | None, last_polled_at: float) -> bool:
+        """
+        True once a user (`member` being its entry in `members()`) is left to its list.
+
+        A new member gets one more poll of its own after joining, which covers
+        the tweets posted before the list started returning them.
+        """
+        if member is None or member["list_id"] not in self.lists:
+            return False
+        return last_polled_at > member["joined_at"]
+
+    async def _mutate(self, list_id: int, operation: str, query_id: str, user_id) -> bool:
+        payload = {
+            "variables": {"listId": str(list_id), "userId": str(user_id)},
+            "features": GQL_FEATURES,
+            "queryId": query_id,
+        }
+        try:
+            account = await self.get_api().pool.get_account(self.lists[list_id])
+            async with account.make_client() as client:
+                rep = await client.post(GQL_URL.format(query_id=query_id, operation=operation), json=payload)
+            rep.raise_for_status()
+            errors = rep.json().get("errors")
+            if errors:
+                raise RuntimeError(errors[0].get("message", errors))
+        except Exception as e:
+            logging.warning(f"{operation} {user_id} on list {list_id} failed: {e}")
+            return False
+        return True
+
+    async def sync(self, user_ids: list):
+        """Add tracked users missing from the lists and drop untracked ones, a batch at a time."""
+        if not self.lists or self._lock.locked():
+            return
+        async with self._lock:
+            store = get_store()
+            members = self.members()
+            tracked = {int(user_id) for user_id in user_ids}
+
+            for user_id in [u for u in members if u not in tracked][: self.sync_batch]:
+                list_id = members[user_id]["list_id"]
+                # Lists dropped from X_LISTS are only forgotten
+                if list_id not in self.lists or await self._mutate(
+                    list_id, "ListRemoveMember", X_GQL_LIST_REMOVE_MEMBER, user_id
+                ):
+                    store.delete("list_members", str(user_id))
+                    del members[user_id]
+
+            sizes = {list_id: 0 for list_id in self.lists}
+            for member in members.values():
+                if member["list_id"] in sizes:
+                    sizes[member["list_id"]] += 1
+            missing = [u for u in tracked if u not in members or members[u]["list_id"] not in self.lists]
+            for user_id in missing[: self.sync_batch]:
+                list_id = min(sizes, key=sizes.get)
+                if sizes[list_id] >= self.max_members:
+                    logging.warning(f"All X Lists are full, {len(missing)} users stay on per-user polling")
+                    break
+                if await self._mutate(list_id, "ListAddMember", X_GQL_LIST_ADD_MEMBER, user_id):
+                    store.put("list_members", str(user_id), {"list_id": list_id, "joined_at": time.time()})
+                    sizes[list_id] += 1
+
+    def get_since_id(self, list_id: int) -> int | None:
+        return get_store().get("list_state", str(list_id))
+
+    def set_since_id(self, list_id: int, since_id: int):
+        get_store().put("list_state", str(list_id), since_id)
+
+    async def get_tweets(
+        self, list_id: int, since_id: int | None, max_tweets: int
+    ) -> tuple[list[Tweet], bool]:
+        """
+        List timeline tweets newer than `since_id`, oldest first; just the newest page without it.
+
+        Also returns whether the walk got back to `since_id`, False when more
+        than `max_tweets` came in since and the older ones were not fetched.
+        """
+        tweets = []
+        async for tweet in self.get_api().list_timeline(list_id, limit=max_tweets if since_id else 20):
+            if since_id is not None and tweet.id <= since_id:
+                return sorted(tweets, key=lambda t: t.id), True
+            tweets.append(tweet)
+        complete = since_id is None or len(tweets) < max_tweets
+        return sorted(tweets, key=lambda t: t.id), complete
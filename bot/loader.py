@@ -8,6 +8,10 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 DB_FILE = BASE_DIR / "db.json"
+DB_JOURNAL_FILE = BASE_DIR / "db.journal"
+SQLITE_DB_FILE = BASE_DIR / "storage.sqlite3"
+MEDIA_CACHE_FILE = BASE_DIR / "media_cache.json"
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", BASE_DIR / "archive"))
 ACCOUNTS_FILE = BASE_DIR / "accounts.txt"
 PROXIES_FILE = BASE_DIR / "proxies.txt"
 
@@ -15,3 +19,73 @@ PROXIES_FILE = BASE_DIR / "proxies.txt"
 # Initialize bot and dispatcher
 TOKEN = os.getenv("BOT_TOKEN")  # Load token from .env
 PARSING_INTERVAL_SEC = os.getenv("PARSING_INTERVAL_SEC")
+# Max users fetched in parallel; 0 means "size to the usable accounts/proxies"
+PARSING_CONCURRENCY = int(os.getenv("PARSING_CONCURRENCY", "0"))
+# A single user fetch is abandoned after this many seconds
+USER_FETCH_TIMEOUT_SEC = int(os.getenv("USER_FETCH_TIMEOUT_SEC", "60"))
+# Upper bound of tweets followed back per user in one poll during a burst
+MAX_TWEETS_PER_POLL = int(os.getenv("MAX_TWEETS_PER_POLL", "100"))
+# Adaptive polling: users are polled between these bounds, faster the more they post
+POLL_MAX_INTERVAL_SEC = int(os.getenv("POLL_MAX_INTERVAL_SEC", "1800"))
+# Aim for this many polls per tweet, based on a user's mean gap between tweets
+POLLS_PER_TWEET = float(os.getenv("POLLS_PER_TWEET", "4"))
+# Timeline requests each account may spend per 15 minute rate-limit window
+REQUESTS_PER_ACCOUNT_WINDOW = int(os.getenv("REQUESTS_PER_ACCOUNT_WINDOW", "50"))
+# Proxy pool: healthy proxies are re-probed this often, dead ones back off up to the max
+PROXY_RECHECK_SEC = int(os.getenv("PROXY_RECHECK_SEC", "600"))
+PROXY_QUARANTINE_MAX_SEC = int(os.getenv("PROXY_QUARANTINE_MAX_SEC", "21600"))
+# Proxy probes: a TCP connect to the proxy first, then a GET of PROXY_PROBE_URL through it.
+# Point it at a local endpoint to test proxies only, or at an X url such as
+# https://x.com/robots.txt to check they reach what the parser uses
+PROXY_PROBE_URL = os.getenv("PROXY_PROBE_URL", "http://httpbin.org/ip")
+PROXY_TCP_TIMEOUT_SEC = float(os.getenv("PROXY_TCP_TIMEOUT_SEC", "1.5"))
+PROXY_HTTP_TIMEOUT_SEC = float(os.getenv("PROXY_HTTP_TIMEOUT_SEC", "5"))
+# Telegram sends per second, per chat and for the whole bot
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+# Sharded mode: polling runs in `python -m bot.worker` processes sharing the SQLite db
+SHARDED = os.getenv("SHARDED", "0") == "1"
+SHARDS = int(os.getenv("SHARDS", "64"))
+SHARD_LEASE_TTL_SEC = int(os.getenv("SHARD_LEASE_TTL_SEC", "30"))
+# Port of the Prometheus /metrics endpoint, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Its labels name accounts and proxies, so it only listens locally unless told otherwise
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# /add_user resolves this many usernames in parallel, retrying each a few times
+RESOLVE_CONCURRENCY = int(os.getenv("RESOLVE_CONCURRENCY", "10"))
+RESOLVE_RETRIES = int(os.getenv("RESOLVE_RETRIES", "3"))
+# After a restart users are walked back to their last seen tweet, but not
+# further than this many seconds (0 turns the catch-up off) or tweets
+BACKFILL_HORIZON_SEC = int(os.getenv("BACKFILL_HORIZON_SEC", "86400"))
+BACKFILL_MAX_TWEETS = int(os.getenv("BACKFILL_MAX_TWEETS", "1000"))
+# Part of the request budget the catch-up may use, the rest stays with live polling
+BACKFILL_BUDGET_SHARE = float(os.getenv("BACKFILL_BUDGET_SHARE", "0.3"))
+# Raw tweet archive: "gzip", or "zstd" with the zstandard package; "off" disables it
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+ARCHIVE_SEGMENT_MB = int(os.getenv("ARCHIVE_SEGMENT_MB", "64"))
+# Tweets are compressed in blocks of this many, or whatever piled up after the flush interval
+ARCHIVE_BLOCK_TWEETS = int(os.getenv("ARCHIVE_BLOCK_TWEETS", "64"))
+ARCHIVE_FLUSH_SEC = int(os.getenv("ARCHIVE_FLUSH_SEC", "300"))
+# Poll tracked users through X Lists: `owner_username:list_id` pairs, comma separated,
+# each list owned by that pool account. Empty polls every user on its own.
+X_LISTS = os.getenv("X_LISTS", "")
+LIST_MAX_MEMBERS = int(os.getenv("LIST_MAX_MEMBERS", "5000"))
+# Members added or removed per sync, X frowns on bulk list edits
+LIST_SYNC_BATCH = int(os.getenv("LIST_SYNC_BATCH", "20"))
+LIST_MAX_TWEETS_PER_POLL = int(os.getenv("LIST_MAX_TWEETS_PER_POLL", "400"))
+# GraphQL query ids of the List mutations, they change with X web client releases
+X_GQL_LIST_ADD_MEMBER = os.getenv("X_GQL_LIST_ADD_MEMBER", "P8tyfv2_0HzofrB5f6_ugw")
+X_GQL_LIST_REMOVE_MEMBER = os.getenv("X_GQL_LIST_REMOVE_MEMBER", "DBZowzFN492FFkBPBptCwg")
+# Circuit breakers for users and accounts: open after this many failures in a row,
+# retried after an exponential backoff starting at BREAKER_BASE_SEC
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+BREAKER_BASE_SEC = int(os.getenv("BREAKER_BASE_SEC", "300"))
+BREAKER_MAX_SEC = int(os.getenv("BREAKER_MAX_SEC", "86400"))
+# Telegram file_ids remembered per media url, so repeated media is not fetched again
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", "20000"))
+# How many of the newest announced tweet ids are remembered per user
+SEEN_TWEETS_PER_USER = int(os.getenv("SEEN_TWEETS_PER_USER", "200"))
+# "json" (db.json + journal) or "sqlite"
+DB_BACKEND = os.getenv("DB_BACKEND", "json")
+# Journal entries written before they are folded into a fresh db.json
+DB_COMPACT_EVERY = int(os.getenv("DB_COMPACT_EVERY", "1000"))
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import orjson
+
+from bot.loader import MEDIA_CACHE_FILE, MEDIA_CACHE_SIZE
+
+if TYPE_CHECKING:
+    from twscrape import Tweet
+
+PHOTO = "photo"
+VIDEO = "video"
+# Telegram albums hold 2-10 items, X tweets at most 4
+MAX_MEDIA_PER_TWEET = 10
+
+
+def _best_video_url(video) -> str | None:
+    variants = [v for v in getattr(video, "variants", []) if "mp4" in (v.contentType or "")]
+    if not variants:
+        return None
+    return max(variants, key=lambda v: v.bitrate or 0).url
+
+
+def tweet_media(tweet: Tweet) -> list[tuple[str, str]]:
+    """(kind, url) of every photo, video and GIF of a tweet, or of what it retweets or quotes."""
+    for source in (tweet, tweet.retweetedTweet, tweet.quotedTweet):
+        media = getattr(source, "media", None) if source is not None else None
+        if media is None:
+            continue
+        items = [(PHOTO, photo.url) for photo in media.photos]
+        items += [(VIDEO, url) for url in map(_best_video_url, media.videos) if url]
+        # GIFs are mp4 clips on X and go out as videos
+        items += [(VIDEO, gif.videoUrl) for gif in getattr(media, "animated", [])]
+        if items:
+            return items[:MAX_MEDIA_PER_TWEET]
+    return []
+
+
+def file_id_of(message) -> str | None:
+    """file_id Telegram assigned to the media of a sent message."""
+    if message is None:
+        return None
+    if getattr(message, "photo", None):
+        return message.photo[-1].file_id
+    for attr in ("video", "animation"):
+        media = getattr(message, attr, None)
+        if media is not None:
+            return media.file_id
+    return None
+
+
+class MediaCache:
+    """
+    Bounded LRU of media url -> Telegram file_id, saved to `path`.
+
+    Once Telegram has fetched a url it returns a file_id that can be sent again
+    without another download, so repeated media (retweets, quotes, several
+    chats) costs no fetch. Saved every `save_every` new entries and on close.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = MEDIA_CACHE_FILE,
+        size: int = MEDIA_CACHE_SIZE,
+        save_every: int = 50,
+    ):
+        self.path = path
+        self.size = size
+        self.save_every = save_every
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self._unsaved = 0
+        if path is not None and path.exists():
+            try:
+                self.entries = OrderedDict(orjson.loads(path.read_bytes()))
+            except orjson.JSONDecodeError:
+                logging.warning(f"Media cache {path} is corrupt, starting empty")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, url: str) -> str | None:
+        file_id = self.entries.get(url)
+        if file_id is not None:
+            self.entries.move_to_end(url)
+        return file_id
+
+    def put(self, url: str, file_id: str):
+        if self.entries.get(url) == file_id:
+            return
+        self.entries[url] = file_id
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def discard(self, url: str):
+        self.entries.pop(url, None)
+
+    def save(self):
+        if self.path is None or not self._unsaved:
+            return
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_bytes(orjson.dumps(list(self.entries.items())))
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
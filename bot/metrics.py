@@ -0,0 +1,222 @@
+import bisect
+import functools
+import time
+
+from aiohttp import web
+
+# Seconds; covers fast DB calls up to slow paginated X fetches
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Seconds from tweet creation to the Telegram message
+LAG_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: dict | None = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self, **labels) -> float:
+        """Sum over all series carrying the given labels."""
+        wanted = set(labels.items())
+        return sum(value for key, value in self.values.items() if wanted <= set(key))
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """A value that is set, or read from `fn` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def value(self, **labels) -> float:
+        if self.fn is not None:
+            return self.fn()
+        return self.values.get(_label_key(labels), 0)
+
+    def render(self) -> list[str]:
+        if self.fn is not None:
+            return [f"{self.name} {self.fn()}"]
+        return super().render()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # label key -> [per-bucket counts (+inf last), sum, count]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self) -> int:
+        return sum(series[2] for series in self.values.values())
+
+    def mean(self) -> float:
+        count = self.count()
+        return sum(series[1] for series in self.values.values()) / count if count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, over all labels."""
+        counts = [0] * (len(self.buckets) + 1)
+        for series in self.values.values():
+            counts = [a + b for a, b in zip(counts, series[0])]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            if running >= q * total:
+                return bound
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            running = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                running += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing how long a sync function takes."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+REGISTRY: list = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+POLL_LAG = register(Histogram("poll_schedule_lag_seconds", "How late a poll started after its user was due"))
+POLLS_TOTAL = register(Counter("polls_total", "User polls finished"))
+FETCH_SECONDS = register(
+    Histogram("x_fetch_seconds", "Latency of fetching a timeline by kind (user, backfill, list) and outcome")
+)
+FETCH_ERRORS = register(Counter("x_fetch_errors_total", "Failed user fetches by reason"))
+ACCOUNT_ERRORS = register(
+    Counter("x_account_errors_total", "Times twscrape took an account out of use, by account")
+)
+OVERDUE_USERS = register(Gauge("scheduler_overdue_users", "Users past their poll time"))
+NOTIFICATION_LAG = register(
+    Histogram("notification_lag_seconds", "Tweet creation to Telegram delivery", LAG_BUCKETS)
+)
+NOTIFICATIONS_SENT = register(Counter("notifications_sent_total", "Tweets delivered to chats"))
+NOTIFICATIONS_FILTERED = register(
+    Counter("notifications_filtered_total", "Tweet deliveries dropped by chat filters")
+)
+TELEGRAM_ERRORS = register(Counter("telegram_errors_total", "Telegram send failures by kind"))
+NOTIFY_QUEUE_DEPTH = register(Gauge("notify_queue_depth", "Notifications waiting to be sent"))
+DB_SECONDS = register(Histogram("db_op_seconds", "Storage call latency by operation"))
+ACCOUNT_ACTIVE = register(Gauge("x_account_active", "1 if twscrape considers the account usable"))
+ACCOUNT_REQUESTS = register(Gauge("x_account_requests", "Requests made by an account, from twscrape"))
+PROXY_PROBES = register(Counter("proxy_probes_total", "Proxy health probes by result"))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def stats_text() -> str:
+    """Short human summary for the /stats command."""
+    return (
+        f"Polls: {int(POLLS_TOTAL.total())}\n"
+        f"X fetch: mean {FETCH_SECONDS.mean():.2f}s, p95 {FETCH_SECONDS.quantile(0.95):g}s, "
+        f"errors {int(FETCH_ERRORS.total())}, account errors {int(ACCOUNT_ERRORS.total())}\n"
+        f"Poll lag: p50 {POLL_LAG.quantile(0.5):g}s, p95 {POLL_LAG.quantile(0.95):g}s\n"
+        f"Overdue users: {int(OVERDUE_USERS.value())}\n"
+        f"Notify lag: p50 {NOTIFICATION_LAG.quantile(0.5):g}s, p95 {NOTIFICATION_LAG.quantile(0.95):g}s\n"
+        f"Sent: {int(NOTIFICATIONS_SENT.total())}, Telegram errors {int(TELEGRAM_ERRORS.total())}, "
+        f"queued {int(NOTIFY_QUEUE_DEPTH.value())}\n"
+        f"DB: mean {DB_SECONDS.mean() * 1000:.2f}ms, p95 {DB_SECONDS.quantile(0.95) * 1000:g}ms\n"
+        f"Proxy probes failed: {int(PROXY_PROBES.total(result='fail'))}/{int(PROXY_PROBES.total())}"
+    )
+
+
+async def start_http_server(port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
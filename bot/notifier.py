@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+import html
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InputMediaPhoto, InputMediaVideo
+
+from bot.loader import TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_RATE
+from bot.media import VIDEO, MediaCache, file_id_of, tweet_media
+from bot.metrics import NOTIFICATION_LAG, NOTIFICATIONS_SENT, TELEGRAM_ERRORS
+from bot.utils import TokenBucket
+
+if TYPE_CHECKING:
+    from twscrape import Tweet
+
+MAX_TEXT_LEN = 4096
+MAX_CAPTION_LEN = 1024
+MAX_MEDIA_GROUP = 10
+BATCH_SEPARATOR = "\n\n"
+# Attempts for a message failing with network errors before it is dropped
+MAX_SEND_ATTEMPTS = 5
+
+
+@dataclass
+class Notification:
+    chat_id: int
+    text: str
+    # (kind, url) pairs, kind being PHOTO or VIDEO
+    media: list[tuple[str, str]] = field(default_factory=list)
+    # Unix time the tweet was posted, for delivery lag
+    created_at: float | None = None
+
+
+def render_tweet(tweet: Tweet) -> tuple[str, list[tuple[str, str]]]:
+    """Message text and media for a tweet."""
+    tweet_type = "📝 Tweet"
+    if tweet.retweetedTweet:
+        tweet_type = "🎥🔄 Retweet"
+    if tweet.quotedTweet:
+        tweet_type = "💬 Quote"
+    text = f"{tweet_type} by {html.escape(tweet.user.displayname)}:\n\n{html.escape(tweet.rawContent)}"
+
+    try:
+        media = tweet_media(tweet)
+    except Exception as e:
+        logging.warning(f"Reading media of tweet {tweet.id} failed: {e}")
+        media = []
+    return text, media
+
+
+def render_notifications(chat_ids: list[int], tweets: list[Tweet]) -> list[Notification]:
+    """One notification per tweet and chat, each tweet rendered once."""
+    notifications = []
+    for tweet in tweets:
+        text, media = render_tweet(tweet)
+        created_at = tweet.date.timestamp()
+        notifications += [Notification(chat_id, text, media, created_at) for chat_id in chat_ids]
+    return notifications
+
+
+def _truncate(text: str, limit: int) -> str:
+    """
+    Cut HTML-escaped `text` to `limit` characters as Telegram counts them.
+
+    The cut is made on the unescaped text, so it cannot split an entity like &amp;.
+    """
+    plain = html.unescape(text)
+    if len(plain) <= limit:
+        return text
+    return html.escape(plain[: limit - 1] + "…")
+
+
+class Notifier:
+    """
+    Outbound Telegram queue.
+
+    `notify` only enqueues, so the poller never waits on Telegram. Each chat has
+    its own sender task that drains everything queued for it, packs text-only
+    tweets into as few messages as fit and media tweets into albums, and paces
+    sends with a per-chat and a global token bucket, honouring retry_after.
+    An album Telegram rejects is split into one item per tweet, each paced and
+    retried on its own, so a retry never repeats what already went out.
+
+    Media is sent by url the first time and by the file_id Telegram returned for
+    it afterwards, through `media_cache`.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        media_cache: MediaCache | None = None,
+    ):
+        self.bot: Bot | None = None
+        self.media_cache = media_cache if media_cache is not None else MediaCache(path=None)
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._queues: dict[int, asyncio.Queue] = {}
+        self._senders: dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot):
+        self.bot = bot
+
+    async def stop(self):
+        for task in self._senders.values():
+            task.cancel()
+        await asyncio.gather(*self._senders.values(), return_exceptions=True)
+        self._senders.clear()
+        self.media_cache.save()
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def notify(self, chat_ids: list[int], tweets: list[Tweet]):
+        """Queue `tweets` for every chat in `chat_ids`."""
+        for notification in render_notifications(chat_ids, tweets):
+            self.enqueue(notification)
+
+    def enqueue(self, notification: Notification):
+        chat_id = notification.chat_id
+        if chat_id not in self._queues:
+            self._queues[chat_id] = asyncio.Queue()
+        self._queues[chat_id].put_nowait(notification)
+        if chat_id not in self._senders or self._senders[chat_id].done():
+            self._senders[chat_id] = asyncio.create_task(self._send_loop(chat_id))
+
+    async def _send_loop(self, chat_id: int):
+        queue = self._queues[chat_id]
+        bucket = TokenBucket(self.chat_rate, capacity=1)
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            pending = deque(self._pack(chat_id, batch))
+            while pending:
+                try:
+                    follow_up = await self._send(bucket, pending.popleft())
+                except Exception as e:
+                    TELEGRAM_ERRORS.inc(kind="dropped")
+                    logging.warning(f"Dropping message to chat {chat_id}: {e}")
+                    continue
+                # Fallbacks go out next, before anything queued after them
+                pending.extendleft(reversed(follow_up))
+
+    def _pack(self, chat_id: int, batch: list[Notification]):
+        """Turn queued notifications into as few Telegram calls as possible, in order."""
+        texts: list[Notification] = []
+        albums: list[Notification] = []
+
+        def flush_texts():
+            message, packed = "", []
+            for notification in texts:
+                text = _truncate(notification.text, MAX_TEXT_LEN)
+                if message and len(message) + len(BATCH_SEPARATOR) + len(text) > MAX_TEXT_LEN:
+                    yield 1, packed, self._text_sender(chat_id, message)
+                    message, packed = "", []
+                message = f"{message}{BATCH_SEPARATOR}{text}" if message else text
+                packed.append(notification)
+            if message:
+                yield 1, packed, self._text_sender(chat_id, message)
+            texts.clear()
+
+        def flush_albums():
+            # Whole tweets only: all media of a tweet go out in the same album
+            group, items = [], 0
+            for notification in albums:
+                if group and items + len(notification.media) > MAX_MEDIA_GROUP:
+                    yield items, group, self._album_sender(chat_id, group)
+                    group, items = [], 0
+                group.append(notification)
+                items += len(notification.media)
+            if group:
+                yield items, group, self._album_sender(chat_id, group)
+            albums.clear()
+
+        # Keep delivery order: a switch between text and media tweets closes the run
+        for notification in batch:
+            if notification.media:
+                yield from flush_texts()
+                albums.append(notification)
+            else:
+                yield from flush_albums()
+                texts.append(notification)
+        yield from flush_texts()
+        yield from flush_albums()
+
+    def _text_sender(self, chat_id: int, text: str):
+        async def send():
+            await self.bot.send_message(chat_id, text)
+
+        return send
+
+    def _input_media(self, group: list[Notification], cached: bool = True) -> list:
+        """Album items for `group`, each tweet's text as the caption of its first item."""
+        items = []
+        for notification in group:
+            caption = _truncate(notification.text, MAX_CAPTION_LEN)
+            for kind, url in notification.media:
+                media = (self.media_cache.get(url) if cached else None) or url
+                media_class = InputMediaVideo if kind == VIDEO else InputMediaPhoto
+                items.append(media_class(media=media, caption=caption))
+                caption = None
+        return items
+
+    async def _send_media(self, chat_id: int, group: list[Notification], cached: bool = True):
+        items = self._input_media(group, cached)
+        if len(items) == 1:
+            item = items[0]
+            if isinstance(item, InputMediaVideo):
+                sent = [await self.bot.send_video(chat_id, item.media, caption=item.caption)]
+            else:
+                sent = [await self.bot.send_photo(chat_id, item.media, caption=item.caption)]
+        else:
+            sent = await self.bot.send_media_group(chat_id, items)
+        urls = [url for notification in group for _, url in notification.media]
+        for url, message in zip(urls, sent or []):
+            file_id = file_id_of(message)
+            if file_id is not None:
+                self.media_cache.put(url, file_id)
+
+    def _album_sender(self, chat_id: int, group: list[Notification]):
+        """
+        Send `group` as one album. If Telegram rejects it, returns one item per
+        tweet to send instead.
+        """
+
+        async def send():
+            try:
+                await self._send_media(chat_id, group)
+                return []
+            except (TelegramRetryAfter, TelegramNetworkError):
+                raise
+            except TelegramAPIError as e:
+                logging.info(f"Sending an album to chat {chat_id} failed: {e}")
+            # A stale file_id, or one url Telegram could not fetch: go tweet by tweet with fresh urls
+            for notification in group:
+                for _, url in notification.media:
+                    self.media_cache.discard(url)
+            return [
+                (len(notification.media), [notification], self._tweet_media_sender(chat_id, notification))
+                for notification in group
+            ]
+
+        return send
+
+    def _tweet_media_sender(self, chat_id: int, notification: Notification):
+        """Send one tweet's media by url, falling back to its text alone."""
+
+        async def send():
+            try:
+                await self._send_media(chat_id, [notification], cached=False)
+                return []
+            except (TelegramRetryAfter, TelegramNetworkError):
+                raise
+            except TelegramAPIError as e:
+                logging.info(f"Sending media to chat {chat_id} failed, sending the text alone: {e}")
+            text = _truncate(notification.text, MAX_TEXT_LEN)
+            return [(1, [notification], self._text_sender(chat_id, text))]
+
+        return send
+
+    async def _send(self, bucket: TokenBucket, item: tuple) -> list[tuple]:
+        """
+        Send one packed item; `cost` is how many messages it counts as.
+
+        Returns the items to send instead, if the item's sender gave up on it.
+        """
+        cost, notifications, send = item
+        attempt = 0
+        while True:
+            for _ in range(cost):
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+            try:
+                follow_up = await send()
+                break
+            except TelegramRetryAfter as e:
+                TELEGRAM_ERRORS.inc(kind="retry_after")
+                logging.warning(f"Telegram flood limit, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramNetworkError:
+                TELEGRAM_ERRORS.inc(kind="network")
+                attempt += 1
+                if attempt >= MAX_SEND_ATTEMPTS:
+                    raise
+                await asyncio.sleep(2**attempt)
+        if follow_up:
+            return follow_up
+
+        now = time.time()
+        NOTIFICATIONS_SENT.inc(len(notifications))
+        for notification in notifications:
+            if notification.created_at:
+                NOTIFICATION_LAG.observe(now - notification.created_at)
+        return []
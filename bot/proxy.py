@@ -1,20 +1,74 @@
 import aiohttp
 import asyncio
+from collections import Counter
+import csv
 from datetime import datetime
 import os
 import socket
-from bot.loader import PROXIES_FILE
+import time
+from bot.loader import PROXIES_FILE, PROXY_HTTP_TIMEOUT_SEC, PROXY_PROBE_URL, PROXY_TCP_TIMEOUT_SEC
 
-async def check_proxy(session, proxy, timeout=5, test_url="http://httpbin.org/ip"):
+# Stage a failed check stopped at, reported in the results' `stage`
+STAGE_FORMAT = "format"
+STAGE_TCP = "tcp"
+STAGE_HTTP = "http"
+
+async def tcp_prescreen(host, port, timeout=PROXY_TCP_TIMEOUT_SEC):
+    """
+    Open and close a TCP connection to a proxy.
+
+    Dead hosts fail here within `timeout` instead of holding up a full HTTP probe.
+
+    Returns:
+        str: Error, or None if the proxy accepted the connection
+    """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        return "TCP connect timeout"
+    except OSError as e:
+        return f"TCP connect failed: {e.strerror or e}"
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return None
+
+def new_probe_session(max_concurrent=100, keepalive_sec=60):
+    """
+    Session for check_proxy.
+
+    Connections are kept alive for `keepalive_sec`, so re-checking a proxy with
+    the same session reuses its connection (or CONNECT tunnel) instead of a new
+    handshake. A kept connection the proxy has dropped meanwhile is retried on
+    a fresh one by aiohttp.
+    """
+    connector = aiohttp.TCPConnector(limit=max_concurrent, keepalive_timeout=keepalive_sec)
+    return aiohttp.ClientSession(connector=connector)
+
+async def check_proxy(
+    session,
+    proxy,
+    timeout=PROXY_HTTP_TIMEOUT_SEC,
+    test_url=PROXY_PROBE_URL,
+    tcp_timeout=PROXY_TCP_TIMEOUT_SEC,
+):
     """
     Asynchronously check if a proxy is working.
-    
+
+    The check runs in stages and stops at the first failing one, which is
+    reported in `stage`: the proxy string is parsed ("format"), a TCP
+    connection is opened to the proxy ("tcp"), then `test_url` is fetched
+    through it ("http").
+
     Args:
-        session: aiohttp ClientSession
+        session: aiohttp ClientSession, see new_probe_session
         proxy (str): Proxy in format 'ip:port' or 'ip:port:username:password'
-        timeout (int): Timeout in seconds
+        timeout (float): Timeout of the HTTP stage in seconds
         test_url (str): URL to test against
-        
+        tcp_timeout (float): Timeout of the TCP stage in seconds, 0 skips it
+
     Returns:
         dict: Proxy check results
     """
@@ -22,87 +76,85 @@ async def check_proxy(session, proxy, timeout=5, test_url="http://httpbin.org/ip
     result = {
         'proxy': proxy,
         'working': False,
+        'stage': STAGE_FORMAT,
         'response_time': None,
         'error': None,
         'external_ip': None,
         'checked_at': datetime.now().isoformat()
     }
-    
-    try:
-        # Validate proxy format
-        if len(proxy_parts) not in (2, 4):
-            result['error'] = "Invalid proxy format"
-            return result
 
-        # Basic IP validation
-        try:
-            socket.inet_aton(proxy_parts[0])
-        except socket.error:
-            result['error'] = "Invalid IP address"
-            return result
+    # Validate proxy format
+    if len(proxy_parts) not in (2, 4) or not proxy_parts[1].isdigit():
+        result['error'] = "Invalid proxy format"
+        return result
 
-        # Prepare proxy URL
-        if len(proxy_parts) == 2:  # ip:port
-            proxy_url = f"http://{proxy}"
-        else:  # ip:port:username:password
-            proxy_url = f"http://{proxy_parts[2]}:{proxy_parts[3]}@{proxy_parts[0]}:{proxy_parts[1]}"
+    # Basic IP validation
+    try:
+        socket.inet_aton(proxy_parts[0])
+    except socket.error:
+        result['error'] = "Invalid IP address"
+        return result
 
-        conn = aiohttp.TCPConnector(force_close=True, enable_cleanup_closed=True)
-        proxy_dict = {
-            'http': proxy_url,
-            'https': proxy_url
-        }
+    if tcp_timeout:
+        result['stage'] = STAGE_TCP
+        result['error'] = await tcp_prescreen(proxy_parts[0], int(proxy_parts[1]), tcp_timeout)
+        if result['error']:
+            return result
 
-        start_time = datetime.now()
-        
-        try:
-            async with session.get(
-                test_url,
-                proxy=proxy_url if 'http://' in proxy_url else f'http://{proxy_url}',
-                timeout=aiohttp.ClientTimeout(total=timeout),
-                allow_redirects=False
-            ) as response:
-                response_time = (datetime.now() - start_time).total_seconds()
-                result['response_time'] = round(response_time, 2)
-                
-                if response.status == 200:
-                    result['working'] = True
-                    try:
-                        data = await response.json()
-                        result['external_ip'] = data.get('origin', 'Unknown')
-                    except:
-                        result['external_ip'] = 'Unknown'
-                else:
-                    result['error'] = f"Status code: {response.status}"
-        except asyncio.TimeoutError:
-            result['error'] = "Timeout"
-        except Exception as e:
-            result['error'] = str(e)
-            
+    result['stage'] = STAGE_HTTP
+    start_time = time.perf_counter()
+    try:
+        async with session.get(
+            test_url,
+            proxy=proxy_url(proxy),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            allow_redirects=False
+        ) as response:
+            result['response_time'] = round(time.perf_counter() - start_time, 2)
+            if response.status != 200:
+                result['error'] = f"Status code: {response.status}"
+                return result
+            try:
+                data = await response.json(content_type=None)
+                result['external_ip'] = data.get('origin', 'Unknown')
+            except (ValueError, AttributeError):
+                # X and local endpoints do not echo the IP back
+                await response.read()
+                result['external_ip'] = 'Unknown'
+    except asyncio.TimeoutError:
+        result['error'] = "Timeout"
+        return result
     except Exception as e:
-        result['error'] = str(e)
-    
+        result['error'] = str(e) or type(e).__name__
+        return result
+
+    result['working'] = True
+    result['stage'] = None
     return result
 
-async def check_proxies(proxies, max_concurrent=100):
+async def check_proxies(proxies, max_concurrent=100, session=None):
     """
     Check multiple proxies concurrently with async.
     
     Args:
         proxies (list): List of proxy strings
         max_concurrent (int): Maximum concurrent checks
+        session: Session to reuse across calls; a new one is opened and closed if None
         
     Returns:
         list: List of results
     """
-    results = []
-    connector = aiohttp.TCPConnector(limit=max_concurrent, force_close=True)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = [check_proxy(session, proxy) for proxy in proxies]
-        results = await asyncio.gather(*tasks, return_exceptions=False)
-    
-    return results
+    if session is None:
+        async with new_probe_session(max_concurrent) as session:
+            return await check_proxies(proxies, max_concurrent, session)
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def check(proxy):
+        async with semaphore:
+            return await check_proxy(session, proxy)
+
+    return await asyncio.gather(*(check(proxy) for proxy in proxies))
 
 def load_proxies(filename="proxies.txt"):
     """
@@ -122,6 +174,19 @@ def load_proxies(filename="proxies.txt"):
         return [line.strip() for line in f 
                 if line.strip() and not line.startswith('#')]
 
+def iter_proxies(filename="proxies.txt"):
+    """
+    Lazily yield proxies from file, one line at a time.
+
+    Args:
+        filename (str): Path to proxy file
+    """
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
 def save_results_txt(proxies, filename="proxies.txt"):
     """
     Save results to text file.
@@ -145,17 +210,129 @@ def save_results_csv(results, filename="proxy_results.csv"):
         results (list): List of proxy results
         filename (str): Output filename
     """
-    import csv
-    
     with open(filename, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=[
-            'proxy', 'working', 'response_time', 'external_ip', 'error', 'checked_at'
-        ])
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
         writer.writeheader()
         writer.writerows(results)
     print(f"Results saved to {filename}")
 
-async def get_active_proxies(update_existing_file=True) -> list[str]:
+CSV_FIELDS = ['proxy', 'working', 'stage', 'response_time', 'external_ip', 'error', 'checked_at']
+
+def load_checked_proxies(filename="proxy_results.csv"):
+    """
+    Proxies that already have a row in a results CSV.
+
+    Args:
+        filename (str): CSV written by save_results_csv or check_proxies_stream
+
+    Returns:
+        set: Proxy strings
+    """
+    if not os.path.exists(filename):
+        return set()
+    with open(filename, 'r', newline='') as f:
+        return {row['proxy'] for row in csv.DictReader(f) if row.get('proxy')}
+
+async def check_proxies_stream(
+    input_file="proxies.txt",
+    csv_filename="proxy_results.csv",
+    txt_filename=None,
+    workers=100,
+    resume=True,
+    progress_every_sec=5,
+):
+    """
+    Check a proxy list of any size with bounded memory.
+
+    Proxies are read lazily and handed to a fixed pool of workers, and every
+    result is appended to the CSV (and working proxies to the TXT) as soon as it
+    is known. With `resume` proxies already present in the CSV are skipped, so an
+    interrupted run picks up where it stopped.
+
+    Args:
+        input_file (str): Proxy list, one per line
+        csv_filename (str): Results CSV, appended to
+        txt_filename (str): Optional file to append working proxies to
+        workers (int): Concurrent checks
+        resume (bool): Skip proxies already in `csv_filename`
+        progress_every_sec (int): How often progress is printed
+
+    Returns:
+        dict: Totals of the run
+    """
+    done = load_checked_proxies(csv_filename) if resume else set()
+    stats = {'checked': 0, 'working': 0, 'skipped': 0}
+    failed = Counter()
+    queue = asyncio.Queue(maxsize=workers * 2)
+    start_time = time.perf_counter()
+
+    mode = 'a' if resume else 'w'
+    write_header = not resume or not os.path.exists(csv_filename) or os.path.getsize(csv_filename) == 0
+    fields = CSV_FIELDS
+    if not write_header:
+        # Keep appending in the columns of the existing file, written before `stage` was added
+        with open(csv_filename, 'r', newline='') as f:
+            fields = next(csv.reader(f), None) or CSV_FIELDS
+    csv_file = open(csv_filename, mode, newline='')
+    txt_file = open(txt_filename, mode) if txt_filename else None
+    writer = csv.DictWriter(csv_file, fieldnames=fields, extrasaction='ignore')
+    if write_header:
+        writer.writeheader()
+
+    async def worker(session):
+        while True:
+            proxy = await queue.get()
+            if proxy is None:
+                return
+            result = await check_proxy(session, proxy)
+            writer.writerow(result)
+            csv_file.flush()
+            stats['checked'] += 1
+            if result['working']:
+                stats['working'] += 1
+                if txt_file:
+                    txt_file.write(f"{proxy}\n")
+                    txt_file.flush()
+            else:
+                failed[result['stage']] += 1
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(progress_every_sec)
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"Checked {stats['checked']} (working {stats['working']}, "
+                f"skipped {stats['skipped']}) - {stats['checked'] / elapsed:.1f} proxies/s"
+            )
+
+    progress = asyncio.create_task(report_progress())
+    try:
+        async with new_probe_session(workers) as session:
+            tasks = [asyncio.create_task(worker(session)) for _ in range(workers)]
+            for proxy in iter_proxies(input_file):
+                if proxy in done:
+                    stats['skipped'] += 1
+                    continue
+                await queue.put(proxy)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+    finally:
+        progress.cancel()
+        csv_file.close()
+        if txt_file:
+            txt_file.close()
+
+    duration = time.perf_counter() - start_time
+    print(f"\nCompleted in {duration:.2f} seconds")
+    print(f"Working proxies: {stats['working']}/{stats['checked']}, skipped {stats['skipped']} already checked")
+    if failed:
+        print("Failed at stage: " + ", ".join(f"{stage} {count}" for stage, count in failed.most_common()))
+    stats['failed'] = dict(failed)
+    print(f"Results saved to {csv_filename}")
+    return stats
+
+async def get_active_proxies(update_existing_file=False) -> list[str]:
     proxies = load_proxies(PROXIES_FILE)
     
     print(f"Loaded {len(proxies)} proxies.")
@@ -179,6 +356,9 @@ async def get_active_proxies(update_existing_file=True) -> list[str]:
     print(f"\nCompleted in {duration:.2f} seconds")
     print(f"Working proxies: {working}/{len(proxies)} ({working/len(proxies)*100:.1f}%)")
     print(f"Average response time: {avg_time:.2f}s")
+    failed = Counter(r['stage'] for r in results if not r['working'])
+    if failed:
+        print("Failed at stage: " + ", ".join(f"{stage} {count}" for stage, count in failed.most_common()))
     
     proxies = [r['proxy'] for r in results if r['working']]
     if update_existing_file:
@@ -187,7 +367,7 @@ async def get_active_proxies(update_existing_file=True) -> list[str]:
     return proxies
 
 async def main():
-    await get_active_proxies()
+    await get_active_proxies(update_existing_file=True)
 
 
 def format_proxy_auth(proxy_str):
@@ -210,6 +390,24 @@ def format_proxy_auth(proxy_str):
     return None
 
 
+def proxy_host(proxy_str):
+    """
+    Only the host:port of a proxy string, safe to log: the rest holds credentials.
+
+    Example: "1.2.3.4:8080:user:pass" -> "1.2.3.4:8080"
+    """
+    return ":".join(proxy_str.split(":")[:2])
+
+
+def proxy_url(proxy_str):
+    """
+    Proxy string from proxies.txt as a URL, with or without credentials.
+
+    Example: "1.2.3.4:8080" -> "http://1.2.3.4:8080"
+    """
+    return format_proxy_auth(proxy_str) or f"http://{proxy_str}"
+
+
 if __name__ == "__main__":
     # Windows requires this for asyncio
     if os.name == 'nt':
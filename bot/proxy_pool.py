@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+
+from bot.breakers import CLOSED, HALF_OPEN, OPEN, BreakerBoard
+from bot.db import get_store
+from bot.loader import PROXIES_FILE, PROXY_QUARANTINE_MAX_SEC, PROXY_RECHECK_SEC
+from bot.metrics import PROXY_PROBES
+from bot.proxy import check_proxies, load_proxies, new_probe_session, proxy_host
+
+# Weight of the newest probe in the latency / success moving averages
+PROXY_EWMA_ALPHA = 0.3
+# First quarantine after a failure, doubled on every further failure in a row
+QUARANTINE_BASE_SEC = 60
+# Proxies whose success average drops below this are not handed out
+MIN_SUCCESS_RATE = 0.5
+
+
+class ProxyStats:
+    def __init__(self, proxy: str, saved: dict | None = None):
+        self.proxy = proxy
+        self.latency: float | None = None
+        self.success_rate: float | None = None
+        self.checked_at = 0.0
+        if saved:
+            self.latency = saved["latency"]
+            self.success_rate = saved["success_rate"]
+            self.checked_at = saved["checked_at"]
+
+    def to_dict(self) -> dict:
+        return {"latency": self.latency, "success_rate": self.success_rate, "checked_at": self.checked_at}
+
+    @property
+    def checked(self) -> bool:
+        return self.success_rate is not None
+
+    def record(self, working: bool, latency: float | None):
+        self.checked_at = time.time()
+        success = 1.0 if working else 0.0
+        if self.success_rate is None:
+            self.success_rate = success
+        else:
+            self.success_rate = PROXY_EWMA_ALPHA * success + (1 - PROXY_EWMA_ALPHA) * self.success_rate
+        if working and latency is not None:
+            self.latency = (
+                latency
+                if self.latency is None
+                else PROXY_EWMA_ALPHA * latency + (1 - PROXY_EWMA_ALPHA) * self.latency
+            )
+
+
+class ProxyPool:
+    """
+    Long-lived view of proxies.txt with health scores.
+
+    A background task re-probes proxies on a schedule and keeps an EWMA of latency
+    and success rate per proxy, saved in the db so a restart starts from the last
+    known scores and only re-probes proxies that are due. A failing proxy's circuit breaker opens
+    (quarantine) with exponential backoff instead of the proxy being removed, and
+    is re-probed once the backoff is over. `best()` answers from the current
+    scores without waiting for a check.
+    """
+
+    def __init__(
+        self,
+        proxies_file: Path = PROXIES_FILE,
+        recheck_sec: int = PROXY_RECHECK_SEC,
+        max_concurrent: int = 100,
+    ):
+        self.proxies_file = proxies_file
+        self.recheck_sec = recheck_sec
+        self.max_concurrent = max_concurrent
+        self.stats: dict[str, ProxyStats] = {}
+        # Opens on the first failed probe; persisted, so dead proxies stay benched across restarts
+        self.breakers = BreakerBoard(
+            "proxy", threshold=1, base_sec=QUARANTINE_BASE_SEC, max_sec=PROXY_QUARANTINE_MAX_SEC
+        )
+        self._task: asyncio.Task | None = None
+        # Kept across probe rounds, so re-probes reuse connections to the proxies
+        self._session = None
+        self.reload()
+
+    def reload(self):
+        """Pick up proxies added to or removed from the file, keeping known scores."""
+        store = get_store()
+        proxies = load_proxies(self.proxies_file)
+        # Only what this pool loaded before is its to clean up, workers with
+        # other proxy files share the saved scores and breakers
+        removed = self.stats.keys() - set(proxies)
+        self.stats = {
+            proxy: self.stats.get(proxy) or ProxyStats(proxy, store.get("proxy_stats", proxy))
+            for proxy in proxies
+        }
+        with store.batch():
+            for proxy in removed:
+                self.breakers.success(proxy)
+                store.delete("proxy_stats", proxy)
+        self.breakers.forget(self.breakers.breakers.keys() - self.stats.keys())
+
+    def record(self, proxy: str, working: bool, latency: float | None = None, error: str = "probe failed"):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            stats = self.stats[proxy] = ProxyStats(proxy)
+        stats.record(working, latency)
+        get_store().put("proxy_stats", proxy, stats.to_dict())
+        if working:
+            self.breakers.success(proxy)
+        else:
+            self.breakers.failure(proxy, error)
+        PROXY_PROBES.inc(proxy=proxy_host(proxy), result="ok" if working else "fail")
+
+    def is_healthy(self, proxy: str) -> bool:
+        stats = self.stats.get(proxy)
+        if stats is None or self.breakers.state(proxy) != CLOSED:
+            return False
+        # Never checked proxies are given the benefit of the doubt
+        return not stats.checked or stats.success_rate >= MIN_SUCCESS_RATE
+
+    def is_due(self, proxy: str, now: float) -> bool:
+        state = self.breakers.state(proxy)
+        if state == OPEN:
+            return False
+        if state == HALF_OPEN:
+            # Quarantine is over, retry right away
+            return True
+        return now - self.stats[proxy].checked_at >= self.recheck_sec
+
+    def best(self, n: int | None = None) -> list[str]:
+        """Healthy proxies, checked ones first by success rate then latency."""
+        healthy = [stats for stats in self.stats.values() if self.is_healthy(stats.proxy)]
+        healthy.sort(
+            key=lambda s: (
+                not s.checked,
+                -(s.success_rate or 0),
+                s.latency if s.latency is not None else float("inf"),
+            )
+        )
+        proxies = [stats.proxy for stats in healthy]
+        return proxies if n is None else proxies[:n]
+
+    def summary(self) -> dict:
+        return {
+            "total": len(self.stats),
+            "healthy": sum(1 for s in self.stats.values() if s.checked and self.is_healthy(s.proxy)),
+            "quarantined": sum(1 for proxy in self.stats if self.breakers.state(proxy) == OPEN),
+            "unchecked": sum(1 for s in self.stats.values() if not s.checked),
+        }
+
+    async def probe(self, proxies: list[str]) -> list[dict]:
+        if self._session is None or self._session.closed:
+            self._session = new_probe_session(self.max_concurrent, keepalive_sec=self.recheck_sec * 1.5)
+        results = await check_proxies(proxies, max_concurrent=self.max_concurrent, session=self._session)
+        with get_store().batch():
+            for result in results:
+                error = f"{result['stage']}: {result['error']}" if not result["working"] else ""
+                self.record(result["proxy"], result["working"], result["response_time"], error)
+        return results
+
+    async def probe_one(self, proxy: str) -> bool:
+        results = await self.probe([proxy])
+        return bool(results) and results[0]["working"]
+
+    async def run(self, tick_sec: float = 30):
+        while True:
+            self.reload()
+            now = time.time()
+            due = [proxy for proxy in self.stats if self.is_due(proxy, now)]
+            if due:
+                started = time.perf_counter()
+                await self.probe(due)
+                logging.info(
+                    f"Probed {len(due)} proxies in {time.perf_counter() - started:.2f}s: {self.summary()}"
+                )
+            await asyncio.sleep(tick_sec)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
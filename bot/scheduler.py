@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import heapq
+import math
+import time
+from typing import TYPE_CHECKING
+
+from bot.loader import POLL_MAX_INTERVAL_SEC, POLLS_PER_TWEET
+
+if TYPE_CHECKING:
+    from twscrape import Tweet
+
+# X rate limits are counted in 15 minute windows
+RATE_LIMIT_WINDOW_SEC = 15 * 60
+# Weight of the newest gap in the mean gap between a user's tweets
+GAP_EWMA_ALPHA = 0.3
+
+
+def learn_posting_rate(state: dict, tweets: list[Tweet]) -> dict:
+    """
+    Fold the timestamps of freshly fetched tweets into a user's poll state.
+
+    Returns the updated `mean_gap_sec` (EWMA of the time between tweets) and
+    `last_tweet_at` fields, or an empty dict if nothing changed.
+    """
+    mean_gap = state.get("mean_gap_sec")
+    last_tweet_at = state.get("last_tweet_at")
+    changed = False
+    for tweet in sorted(tweets, key=lambda t: t.date):
+        tweeted_at = tweet.date.timestamp()
+        if last_tweet_at is not None and tweeted_at <= last_tweet_at:
+            continue
+        if last_tweet_at is not None:
+            gap = tweeted_at - last_tweet_at
+            mean_gap = gap if mean_gap is None else GAP_EWMA_ALPHA * gap + (1 - GAP_EWMA_ALPHA) * mean_gap
+        last_tweet_at = tweeted_at
+        changed = True
+
+    if not changed:
+        return {}
+    return {"mean_gap_sec": mean_gap, "last_tweet_at": last_tweet_at}
+
+
+class PollScheduler:
+    """
+    Priority queue of tracked users ordered by when they are due for a poll.
+
+    A user's interval is a fraction of their mean gap between tweets, stretched
+    by how long they have been quiet, clamped to [min_interval, max_interval].
+    Users pinned through `pinned_interval_sec` in their poll state skip that.
+    """
+
+    def __init__(
+        self,
+        min_interval_sec: float,
+        max_interval_sec: float = POLL_MAX_INTERVAL_SEC,
+        polls_per_tweet: float = POLLS_PER_TWEET,
+    ):
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max(max_interval_sec, min_interval_sec)
+        self.polls_per_tweet = polls_per_tweet
+        self._heap: list[tuple[float, int]] = []
+        # user_id -> due time; in-flight users are kept at infinity
+        self._due: dict[int, float] = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    def sync(self, user_ids: list[int]):
+        """Start tracking new users (due right away) and forget removed ones."""
+        now = time.monotonic()
+        for user_id in user_ids:
+            if user_id not in self._due:
+                self._schedule(user_id, now)
+        for user_id in self._due.keys() - set(user_ids):
+            del self._due[user_id]
+
+    def user_ids(self) -> list[int]:
+        return list(self._due)
+
+    def remove(self, user_id: int):
+        self._due.pop(user_id, None)
+
+    def postpone(self, user_id: int, delay_sec: float):
+        if user_id in self._due:
+            self._schedule(user_id, time.monotonic() + delay_sec)
+
+    def _schedule(self, user_id: int, at: float):
+        self._due[user_id] = at
+        heapq.heappush(self._heap, (at, user_id))
+
+    def peek(self) -> tuple[int | None, float]:
+        """The next due user and the seconds left until it is due."""
+        while self._heap:
+            at, user_id = self._heap[0]
+            # Entries of removed or rescheduled users are dropped lazily
+            if self._due.get(user_id) != at:
+                heapq.heappop(self._heap)
+                continue
+            return user_id, at - time.monotonic()
+        return None, math.inf
+
+    def due_count(self) -> int:
+        now = time.monotonic()
+        return sum(1 for at in self._due.values() if at <= now)
+
+    def start(self, user_id: int) -> bool:
+        """Take a user off the queue while it is being polled, False if untracked or already taken."""
+        if self._due.get(user_id, math.inf) == math.inf:
+            return False
+        self._due[user_id] = math.inf
+        return True
+
+    def finish(self, user_id: int, state: dict) -> float:
+        """Put a polled user back on the queue, returns its next interval."""
+        interval = self.interval_for(state)
+        if user_id in self._due:
+            self._schedule(user_id, time.monotonic() + interval)
+        return interval
+
+    def interval_for(self, state: dict) -> float:
+        if state.get("pinned_interval_sec"):
+            # Pinned past the bounds by hand in the db, or before they changed
+            return min(max(state["pinned_interval_sec"], self.min_interval_sec), self.max_interval_sec)
+
+        # A long silence counts as a gap too, so quiet users slow down gradually
+        now = time.time()
+        gap = state.get("mean_gap_sec") or 0
+        if state.get("last_tweet_at"):
+            gap = max(gap, now - state["last_tweet_at"])
+        elif state.get("first_polled_at"):
+            gap = max(gap, now - state["first_polled_at"])
+
+        interval = gap / self.polls_per_tweet
+        return min(max(interval, self.min_interval_sec), self.max_interval_sec)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import math
+import time
+
+import orjson
+
+from bot.db_sqlite import SqliteStore
+from bot.loader import SHARD_LEASE_TTL_SEC, SHARDS
+from bot.notifier import Notification, Notifier
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    shard INTEGER PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_worker_id ON leases (worker_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    -- JSON [kind, url] pairs
+    media TEXT NOT NULL,
+    -- when the tweet was posted, for delivery lag
+    created_at REAL NOT NULL
+);
+"""
+
+
+def shard_of(user_id, shards: int = SHARDS) -> int:
+    return int(user_id) % shards
+
+
+class ShardLeases:
+    """
+    Splits tracked users between worker processes through leases in the shared SQLite db.
+
+    Users are hashed into `shards` buckets. Every worker heartbeats, aims for an
+    equal share of the buckets among live workers, hands back what it holds above
+    that share and claims buckets nobody holds or whose lease ran out. A worker
+    that dies simply stops renewing, and the others take over its buckets.
+    """
+
+    def __init__(
+        self,
+        store: SqliteStore,
+        worker_id: str,
+        shards: int = SHARDS,
+        ttl_sec: int = SHARD_LEASE_TTL_SEC,
+    ):
+        self.store = store
+        self.conn = store.conn
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl_sec = ttl_sec
+        self.owned: set[int] = set()
+        self.conn.executescript(SCHEMA)
+
+    def owns(self, user_id) -> bool:
+        return shard_of(user_id, self.shards) in self.owned
+
+    def heartbeat(self) -> set[int]:
+        now = time.time()
+        with self.store.transaction():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                (self.worker_id, now),
+            )
+            self.conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - self.ttl_sec,))
+            (live,) = self.conn.execute("SELECT COUNT(*) FROM workers").fetchone()
+            target = math.ceil(self.shards / max(live, 1))
+
+            self.conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE worker_id = ?", (now + self.ttl_sec, self.worker_id)
+            )
+            owned = [
+                shard
+                for (shard,) in self.conn.execute(
+                    "SELECT shard FROM leases WHERE worker_id = ? ORDER BY shard", (self.worker_id,)
+                )
+            ]
+
+            if len(owned) > target:
+                extra = owned[target:]
+                self.conn.executemany(
+                    "DELETE FROM leases WHERE shard = ? AND worker_id = ?",
+                    [(shard, self.worker_id) for shard in extra],
+                )
+                owned = owned[:target]
+            elif len(owned) < target:
+                held = {
+                    shard
+                    for (shard,) in self.conn.execute(
+                        "SELECT shard FROM leases WHERE expires_at >= ?", (now,)
+                    )
+                }
+                free = [shard for shard in range(self.shards) if shard not in held]
+                claimed = free[: target - len(owned)]
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO leases (shard, worker_id, expires_at) VALUES (?, ?, ?)",
+                    [(shard, self.worker_id, now + self.ttl_sec) for shard in claimed],
+                )
+                owned += claimed
+
+        if set(owned) != self.owned:
+            logging.info(f"Worker {self.worker_id} owns {len(owned)}/{self.shards} shards ({live} workers)")
+        self.owned = set(owned)
+        return self.owned
+
+    def release(self):
+        with self.store.transaction():
+            self.conn.execute("DELETE FROM leases WHERE worker_id = ?", (self.worker_id,))
+            self.conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        self.owned = set()
+
+    async def run(self):
+        while True:
+            self.heartbeat()
+            await asyncio.sleep(self.ttl_sec / 3)
+
+
+def push_outbox(store: SqliteStore, notifications: list[Notification]):
+    """Hand notifications from a worker to the bot process."""
+    now = time.time()
+    with store.transaction():
+        store.conn.executemany(
+            "INSERT INTO outbox (chat_id, text, media, created_at) VALUES (?, ?, ?, ?)",
+            [
+                (n.chat_id, n.text, orjson.dumps(n.media).decode(), n.created_at or now)
+                for n in notifications
+            ],
+        )
+
+
+class OutboxPump:
+    """Moves notifications written by workers into the bot's Notifier."""
+
+    def __init__(self, store: SqliteStore, notifier: Notifier, batch_size: int = 500):
+        self.store = store
+        self.notifier = notifier
+        self.batch_size = batch_size
+        store.conn.executescript(SCHEMA)
+
+    def drain(self) -> int:
+        rows = self.store.conn.execute(
+            "SELECT id, chat_id, text, media, created_at FROM outbox ORDER BY id LIMIT ?",
+            (self.batch_size,),
+        ).fetchall()
+        if not rows:
+            return 0
+        for _, chat_id, text, media, created_at in rows:
+            media = [tuple(item) for item in orjson.loads(media)]
+            self.notifier.enqueue(Notification(chat_id, text, media, created_at))
+        self.store.conn.execute("DELETE FROM outbox WHERE id <= ?", (rows[-1][0],))
+        return len(rows)
+
+    async def run(self, idle_sec: float = 1):
+        while True:
+            if self.drain() < self.batch_size:
+                await asyncio.sleep(idle_sec)
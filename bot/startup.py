@@ -0,0 +1,39 @@
+"""
+Startup phase timings.
+
+Measured from the start of the process where /proc tells it, from the first
+import of this module otherwise. Each phase is logged once, the first time it
+is reached.
+"""
+import logging
+import os
+import time
+
+
+def _process_age() -> float:
+    """Seconds since this process was started, 0 without /proc."""
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime is field 22, counted after the parenthesized command name (field 2)
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+STARTED = time.perf_counter() - _process_age()
+# phase -> seconds after STARTED
+phases: dict[str, float] = {}
+
+
+def mark(phase: str):
+    if phase in phases:
+        return
+    phases[phase] = time.perf_counter() - STARTED
+    logging.info(f"Startup: {phase} after {phases[phase]:.3f}s")
+
+
+def summary() -> str:
+    return ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items())
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import random
+import time
+
+# Restart delay after a crash, doubled per crash in a row up to the max
+BACKOFF_BASE_SEC = 1
+BACKOFF_MAX_SEC = 300
+
+
+class Supervisor:
+    """
+    Runs a long-lived coroutine as a background task and restarts it when it crashes.
+
+    Restarts back off exponentially with jitter; a run that lasted longer than
+    the max backoff counts as healthy and resets it. `stop()` cancels the task
+    right away instead of waiting for the coroutine to notice a flag, and
+    `start()` refuses to run a second copy.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backoff_base_sec: float = BACKOFF_BASE_SEC,
+        backoff_max_sec: float = BACKOFF_MAX_SEC,
+    ):
+        self.name = name
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.state = "stopped"
+        self.restarts = 0
+        self.failures = 0
+        self.last_error: str | None = None
+        self.started_at: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, factory) -> bool:
+        """Run `factory()` under supervision. False if it is already running."""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self.run(factory), name=self.name)
+        return True
+
+    async def run(self, factory):
+        self.restarts = 0
+        self.failures = 0
+        try:
+            while True:
+                self.state = "running"
+                self.started_at = time.time()
+                try:
+                    await factory()
+                    logging.info(f"{self.name} finished")
+                    return
+                except Exception as e:
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    logging.exception(f"{self.name} crashed")
+
+                if time.time() - self.started_at > self.backoff_max_sec:
+                    self.failures = 0
+                delay = min(self.backoff_base_sec * 2**self.failures, self.backoff_max_sec)
+                delay *= random.uniform(0.8, 1.2)
+                self.failures += 1
+                self.restarts += 1
+                self.state = "backoff"
+                logging.info(f"Restarting {self.name} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        finally:
+            self.state = "stopped"
+
+    async def stop(self) -> bool:
+        """Cancel the task and wait for its cleanup. False if it was not running."""
+        if not self.running:
+            return False
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        return True
+
+    def status(self) -> str:
+        if self.state == "stopped":
+            text = f"{self.name}: stopped"
+        elif self.state == "backoff":
+            text = f"{self.name}: restarting (crashed {self.failures}x in a row)"
+        else:
+            text = f"{self.name}: running for {_duration(time.time() - self.started_at)}"
+        if self.restarts:
+            text += f", {self.restarts} restarts"
+        if self.last_error:
+            text += f"\nlast error: {self.last_error}"
+        return text
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
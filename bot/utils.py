@@ -1,4 +1,6 @@
+import asyncio
 import re
+import time
 
 
 async def get_command_args(message):
@@ -20,6 +22,59 @@ def extract_username(url: str) -> str:
     Returns:
         str: The username (e.g., elonmusk), or empty string if not found
     """
-    pattern = r"https?://(?:www\.)?x\.com/([a-zA-Z0-9_]+)"
+    pattern = r"https?://(?:www\.)?(?:x|twitter)\.com/([a-zA-Z0-9_]+)"
     match = re.match(pattern, url)
     return match.group(1) if match else ""
+
+
+def parse_usernames(text: str) -> list[str]:
+    """
+    Usernames from free text: @names, bare names or profile URLs separated by
+    whitespace or commas. Duplicates are dropped, order is kept.
+    """
+    usernames = []
+    for token in re.split(r"[\s,;]+", text):
+        if not token:
+            continue
+        username = extract_username(token) if token.startswith("http") else token.lstrip("@")
+        if re.fullmatch(r"[A-Za-z0-9_]{1,15}", username) and username not in usernames:
+            usernames.append(username)
+    return usernames
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def set_rate(self, rate: float, capacity: float | None = None):
+        self._refill()
+        self.rate = rate
+        if capacity is not None:
+            self.capacity = capacity
+            self.tokens = min(self.tokens, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
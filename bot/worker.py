@@ -0,0 +1,84 @@
+"""
+Polling worker for sharded mode.
+
+    DB_BACKEND=sqlite python -m bot.worker --accounts accounts-1.txt --accounts-db accounts-1.db --proxies proxies-1.txt
+
+Each worker polls the users of the shards it holds a lease on, with its own
+slice of accounts and proxies, and leaves notifications in the shared outbox
+for the bot process (started with SHARDED=1) to send.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+from pathlib import Path
+
+from twscrape import API, Tweet
+
+from bot.db import close_db, get_store, get_subscribers
+from bot.db_sqlite import SqliteStore
+from bot.filters import FilterEngine
+from bot.archive import TweetArchive
+from bot.loader import (
+    ACCOUNTS_FILE,
+    ARCHIVE_COMPRESSION,
+    ARCHIVE_DIR,
+    BASE_DIR,
+    PARSING_INTERVAL_SEC,
+    PROXIES_FILE,
+)
+from bot.notifier import render_notifications
+from bot.proxy_pool import ProxyPool
+from bot.shard import ShardLeases, push_outbox
+from bot.supervisor import Supervisor
+from bot.x_parser import XManager, XParser
+
+
+async def main(args):
+    store = get_store()
+    if not isinstance(store, SqliteStore):
+        sys.exit("Sharded mode needs the shared SQLite db, set DB_BACKEND=sqlite")
+
+    leases = ShardLeases(store, args.worker_id)
+    leases.heartbeat()
+    heartbeat = asyncio.create_task(leases.run())
+
+    proxy_pool = ProxyPool(args.proxies)
+    proxy_pool.start()
+    # One archive per worker, segments are not shared between writers
+    archive = TweetArchive(ARCHIVE_DIR / args.worker_id) if ARCHIVE_COMPRESSION != "off" else None
+    x_parser = XParser(
+        proxy_pool, api=API(str(args.accounts_db)), accounts_file=args.accounts, archive=archive
+    )
+    x_manager = XManager(x_parser, int(PARSING_INTERVAL_SEC), user_filter=leases.owns)
+
+    # Rules are edited in the bot process, the engine recompiles when their version changes
+    filters = FilterEngine()
+
+    async def on_new_tweet(user_id, tweets: list[Tweet]):
+        for chat_ids, matching in filters.route(user_id, get_subscribers(user_id), tweets):
+            push_outbox(store, render_notifications(chat_ids, matching))
+
+    x_manager.on_new_tweet_cb = on_new_tweet
+    try:
+        # Crashes restart polling with backoff instead of taking the worker down
+        await Supervisor(f"Worker {args.worker_id}").run(x_manager.active)
+    finally:
+        heartbeat.cancel()
+        await proxy_pool.stop()
+        leases.release()
+        if archive is not None:
+            archive.close()
+        close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    parser = argparse.ArgumentParser(description="Sharded polling worker")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--accounts", type=Path, default=ACCOUNTS_FILE)
+    parser.add_argument("--accounts-db", type=Path, default=BASE_DIR / "accounts.db")
+    parser.add_argument("--proxies", type=Path, default=PROXIES_FILE)
+    asyncio.run(main(parser.parse_args()))
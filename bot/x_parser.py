@@ -1,105 +1,327 @@
+from __future__ import annotations
+
 import asyncio
+import itertools
+import logging
+import math
+import time
 from datetime import date
+from pathlib import Path
 from pprint import pprint
+from typing import TYPE_CHECKING
+
+from bot.db import (
+    existing_user_ids,
+    get_cached_user_ids,
+    filter_new_tweets,
+    get_poll_state,
+    save_new_tweets,
+    update_poll_state,
+)
+from bot.accounts import sync_account_pool
+from bot.archive import TweetArchive
+from bot.breakers import CLOSED, HALF_OPEN, BreakerBoard
+from bot.lists import XLists
+from bot.loader import (
+    ACCOUNTS_FILE,
+    BACKFILL_BUDGET_SHARE,
+    BACKFILL_HORIZON_SEC,
+    BACKFILL_MAX_TWEETS,
+    LIST_MAX_TWEETS_PER_POLL,
+    MAX_TWEETS_PER_POLL,
+    PARSING_CONCURRENCY,
+    REQUESTS_PER_ACCOUNT_WINDOW,
+    RESOLVE_CONCURRENCY,
+    RESOLVE_RETRIES,
+    USER_FETCH_TIMEOUT_SEC,
+)
+from bot.metrics import (
+    ACCOUNT_ACTIVE,
+    ACCOUNT_ERRORS,
+    ACCOUNT_REQUESTS,
+    FETCH_ERRORS,
+    FETCH_SECONDS,
+    OVERDUE_USERS,
+    POLL_LAG,
+    POLLS_TOTAL,
+)
+from bot.proxy import proxy_url
+from bot.proxy_pool import ProxyPool
+from bot.scheduler import RATE_LIMIT_WINDOW_SEC, PollScheduler, learn_posting_rate
+from bot import startup
+from bot.utils import TokenBucket
+
+if TYPE_CHECKING:
+    from twscrape import API, Tweet
+
+# How often the account budget and the list of tracked users are refreshed
+REFRESH_EVERY_SEC = 60
+# Tweets twscrape asks for per timeline page, every page is a request of its own
+TIMELINE_PAGE_SIZE = 40
+LIST_PAGE_SIZE = 20
+# Least time between two re-checks of the accounts and their proxies after failed fetches
+INFRA_CHECK_EVERY_SEC = 60
+# Users caught up together after a restart, their tweets are merged by date
+BACKFILL_WAVE_SIZE = 50
 
-from twscrape import API, Tweet, gather
 
-from bot.db import existing_user_ids, filter_new_tweets, save_new_tweets
-from bot.loader import ACCOUNTS_FILE
-from bot.proxy import get_active_proxies, format_proxy_auth
+class EmptyTimeline(Exception):
+    """No tweets came back and the user behind them is suspended, protected or gone."""
 
 class XParser:
-    def __init__(self):
-        self.api = API()
+    def __init__(
+        self,
+        proxy_pool: ProxyPool | None = None,
+        api: API | None = None,
+        accounts_file: Path = ACCOUNTS_FILE,
+        archive: TweetArchive | None = None,
+    ):
+        # Built on first use, importing twscrape is a good part of the bot's startup time
+        self._api = api
+        self.proxy_pool = proxy_pool or ProxyPool()
+        self.accounts_file = accounts_file
+        # Every fetched tweet is kept here, if set
+        self.archive = archive
+        # A locked account is benched and re-enabled for a trial once its backoff is over
+        self.account_breakers = BreakerBoard("account", threshold=1)
         self.interval_sec = 10
+        self.proxies_count = 0
+
+    @property
+    def api(self) -> API:
+        if self._api is None:
+            from twscrape import API
+
+            self._api = API()
+        return self._api
 
     def set_proxy(self, proxy: str):
-        self.api = API(proxy=proxy)
+        from twscrape import API
+
+        self._api = API(proxy=proxy)
         self.load_accounts()
 
     async def load_accounts(self, on_run_out_of_proxies=None):
-        # Option 1. Adding account with cookies (more stable)
-        # Combine ct0 and auth_token into cookies string
-        
-        # Example:
-        # auth_token = "d1ba29557718984d63a28b11cc8a64d887b1d293"
-        # ct0 = "4ae7e4f76c4995a24dc1bac6979ac979d800237505f6b25a8aa8712c7c4b191ab2eebb27a700acffc60e07afb43d8ec08d7c5ea029a556963d79d9fc9033688a89e7bcb6218a53906ed9caf7221371ec"
-        # cookies = f"ct0={ct0}; auth_token={auth_token}"
-        # await self.api.pool.add_account(
-        #     "toleston44282",
-        #     "MyNDmHeTRLi&1001",
-        #     "ho3ymjuly@gmx.com",
-        #     "nr6hztf8Me",
-        #     cookies=cookies,
-        # )
-        proxies = await get_active_proxies()
-        index = 0
-        not_enough_proxies = 0
+        # Accounts are added with cookies (more stable), see accounts.txt format
+        # in bot.accounts.read_accounts_file. Only new or changed accounts are saved,
+        # the proxy pool answers from its current scores without a re-check.
         try:
-            with open(ACCOUNTS_FILE, "r", encoding="utf-8") as file:
-                for line in file:
-                    # Skip empty lines
-                    if not line.strip():
-                        continue
-
-                    # Split line by colon
-                    parts = line.strip().split(":")
-                    if len(parts) < 6:
-                        print(f"Skipping invalid account line: {line.strip()}")
-                        continue
-
-                    # Extract account details
-                    username = parts[0]
-                    password = parts[1]
-                    email = parts[2]
-                    email_password = parts[3]
-                    ct0 = parts[4]
-                    auth_token = parts[5]
-
-                    # Combine ct0 and auth_token into cookies string
-                    cookies = f"ct0={ct0}; auth_token={auth_token}"
-
-                    # Add account to API pool
-                    try:
-                        proxy = format_proxy_auth(proxies[index])
-                    except IndexError:
-                        proxy = None
-                        not_enough_proxies += 1
-                        print (f"Proxy index out of range: {index}")
-                    await self.api.pool.add_account(
-                        username=username,
-                        password=password,
-                        email=email,
-                        email_password=email_password,
-                        cookies=cookies,
-                        proxy=proxy,
-                    )
-                    index += 1
-        except FileNotFoundError:
-            print(f"Account file not found: {ACCOUNTS_FILE}")
+            summary = await sync_account_pool(self.api, self.proxy_pool, self.accounts_file)
         except Exception as e:
             print(f"Error loading accounts: {str(e)}")
+            return
+        self.proxies_count = len(self.proxy_pool.best())
 
+        not_enough_proxies = summary["without_proxy"]
         if not_enough_proxies > 0:
             if on_run_out_of_proxies:
                 await on_run_out_of_proxies(not_enough_proxies)
+
+    async def has_usable_account(self) -> bool:
+        """Whether accounts.db already holds an active account, e.g. saved by the last run."""
+        return any(account["active"] for account in await self.api.pool.accounts_info())
+
+    async def usable_slots(self) -> int:
+        """How many requests the account pool can serve in parallel."""
+        accounts = await self.api.pool.accounts_info()
+        for account in accounts:
+            ACCOUNT_ACTIVE.set(int(bool(account["active"])), account=account["username"])
+            ACCOUNT_REQUESTS.set(account["total_req"], account=account["username"])
+            await self.check_account(account)
+        slots = sum(1 for account in accounts if account["active"])
+        if self.proxies_count:
+            slots = min(slots, self.proxies_count)
+        return max(slots, 1)
+
+    async def check_account(self, account: dict):
+        username = account["username"]
+        state = self.account_breakers.state(username)
+        if account["active"]:
+            self.account_breakers.success(username)
+        elif state == HALF_OPEN and self.account_breakers.allow(username):
+            # twscrape does not retry inactive accounts on its own
+            logging.info(f"Re-enabling account {username} for a trial")
+            await self.api.pool.set_active(username, True)
+        elif state == CLOSED or self.account_breakers.breakers[username]["state"] == HALF_OPEN:
+            # Newly inactive, or the trial failed. twscrape does not say which account
+            # served a failed request, this is where its failures show up per account.
+            ACCOUNT_ERRORS.inc(account=username)
+            self.account_breakers.failure(username, account.get("error_msg") or "inactive")
+
+    async def check_infrastructure(self):
+        """
+        Re-check the accounts and the proxies they use after fetches failed for reasons not the users'.
+
+        twscrape does not say which account or proxy a failed request went
+        through, so all of them are looked at: accounts it took out of use open
+        their breakers in check_account, proxies failing a probe open theirs.
+        """
+        await self.usable_slots()
+        raw_by_url = {proxy_url(proxy): proxy for proxy in self.proxy_pool.stats}
+        in_use = {raw_by_url.get(account.proxy) for account in await self.api.pool.get_all() if account.proxy}
+        in_use.discard(None)
+        if in_use:
+            await self.proxy_pool.probe(sorted(in_use))
+
     async def get_user_id_by_username(self, username: str):
         user = await self.api.user_by_login(username)
         if user:
             return user.id
 
-    async def get_tweets(self, user_id, limit: int = 2) -> list[Tweet]:
-        tweets = await gather(self.api.user_tweets(user_id, limit=limit))
-        # Skip older tweets
-        return [tweet for tweet in tweets if tweet.date.date() >= date.today()]
+    async def resolve_user_ids(
+        self,
+        usernames: list[str],
+        concurrency: int = RESOLVE_CONCURRENCY,
+        retries: int = RESOLVE_RETRIES,
+    ) -> tuple[dict[str, int], list[str]]:
+        """
+        Map usernames to user ids, cached ones first, the rest looked up concurrently.
+
+        Returns the resolved ids and the usernames that could not be resolved.
+        Newly resolved ids are not saved here, the caller commits them in one go.
+        """
+        resolved = get_cached_user_ids(usernames)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def resolve(username: str):
+            async with semaphore:
+                for attempt in range(retries):
+                    try:
+                        user_id = await self.get_user_id_by_username(username)
+                    except Exception as e:
+                        logging.warning(f"Resolving {username} failed: {e}")
+                        await asyncio.sleep(2**attempt)
+                        continue
+                    # No exception and no user: it does not exist, no point retrying
+                    if user_id is not None:
+                        resolved[username] = user_id
+                    return
+
+        await asyncio.gather(*(resolve(username) for username in usernames if username not in resolved))
+        failed = [username for username in usernames if username not in resolved]
+        return resolved, failed
+
+    async def get_tweets(
+        self,
+        user_id,
+        since_id: int | None = None,
+        limit: int = 2,
+        max_tweets: int = MAX_TWEETS_PER_POLL,
+        not_before: float | None = None,
+        budget: TokenBucket | None = None,
+    ) -> list[Tweet]:
+        """
+        Tweets of `user_id` newer than `since_id`, oldest first.
+
+        Timeline pages are requested lazily and the walk stops at the first tweet
+        not newer than `since_id`, so a quiet user costs a single page while a
+        burst is followed back for up to `max_tweets` tweets. With `not_before`
+        (a timestamp) it also stops at tweets posted before then.
+        Without either only the newest `limit` tweets are returned.
+
+        With `budget` every request after the first, which the caller pays for,
+        takes a token from it before it is made.
+        """
+        if since_id is None and not_before is None:
+            tweets = [tweet async for tweet in self.api.user_tweets(user_id, limit=limit)]
+            if not tweets:
+                await self.check_readable(user_id, budget)
+            return self.keep(sorted(tweets, key=lambda t: t.id))
+
+        tweets = []
+        old_tweets = 0
+        seen = 0
+        async for tweet in self.api.user_tweets(user_id, limit=max_tweets):
+            seen += 1
+            if budget is not None and seen % TIMELINE_PAGE_SIZE == 0:
+                # Asking for the next tweet fetches the next page
+                await budget.acquire()
+            if (since_id is None or tweet.id > since_id) and (
+                not_before is None or tweet.date.timestamp() >= not_before
+            ):
+                tweets.append(tweet)
+                continue
+            # The first old tweet may be a pinned one placed above the new ones
+            old_tweets += 1
+            if old_tweets >= 2:
+                break
+        if not seen:
+            await self.check_readable(user_id, budget)
+        return self.keep(sorted(tweets, key=lambda t: t.id))
+
+    async def check_readable(self, user_id, budget: TokenBucket | None = None):
+        """
+        Tell an empty timeline from an unreadable one, raising EmptyTimeline for the latter.
+
+        X answers both a user without tweets and a suspended or protected one
+        with an empty page, only a lookup of the user separates them.
+        """
+        if budget is not None:
+            await budget.acquire()
+        user = await self.api.user_by_id(int(user_id))
+        if user is None:
+            raise EmptyTimeline(f"User {user_id} not found")
+        if user.protected:
+            raise EmptyTimeline(f"User {user_id} is protected")
+
+    def keep(self, tweets: list[Tweet]) -> list[Tweet]:
+        if self.archive is not None and tweets:
+            try:
+                self.archive.append(tweets)
+            except OSError as e:
+                # A full disk must not stop notifications
+                logging.warning(f"Archiving tweets failed: {e}")
+        return tweets
 
 
 class XManager:
-    def __init__(self, x_parser: XParser, interval_sec: int = 10):
+    def __init__(
+        self,
+        x_parser: XParser,
+        interval_sec: int = 10,
+        concurrency: int = PARSING_CONCURRENCY,
+        user_timeout_sec: int = USER_FETCH_TIMEOUT_SEC,
+        requests_per_account_window: int = REQUESTS_PER_ACCOUNT_WINDOW,
+        user_filter=None,
+        backfill_horizon_sec: int = BACKFILL_HORIZON_SEC,
+        backfill_max_tweets: int = BACKFILL_MAX_TWEETS,
+        backfill_share: float = BACKFILL_BUDGET_SHARE,
+        lists: XLists | None = None,
+        list_max_tweets: int = LIST_MAX_TWEETS_PER_POLL,
+    ):
         self.x_parser = x_parser
         self.interval_sec = interval_sec
+        self.concurrency = concurrency
+        self.user_timeout_sec = user_timeout_sec
+        self.requests_per_account_window = requests_per_account_window
+        # Optional predicate limiting this manager to a slice of the tracked users
+        self.user_filter = user_filter
         self.is_active = False
         self.on_new_tweet_cb = None
+        self.scheduler = PollScheduler(min_interval_sec=interval_sec)
+        # Shared by all accounts: one token per timeline request
+        self.budget = TokenBucket(rate=1)
+        self.semaphore = asyncio.Semaphore(1)
+        self.polls_done = 0
+        self.backfill_horizon_sec = backfill_horizon_sec
+        self.backfill_max_tweets = backfill_max_tweets
+        self.backfill_share = backfill_share
+        # While a catch-up runs it draws from its own bucket, split off the budget
+        self.backfill_budget = TokenBucket(rate=1)
+        self.backfilling = False
+        # Users whose fetches keep failing are skipped until their backoff is over
+        self.breakers = BreakerBoard("user")
+        self.request_rate = 1.0
+        self.slots = 1
+        # Users in a synced X List are polled through its timeline instead
+        self.lists = lists
+        self.list_max_tweets = list_max_tweets
+        self.last_polled: dict = {}
+        # List members polled on their own until their next poll, their list walk left a gap
+        self.list_fallback: set[int] = set()
+        self._list_sync: asyncio.Task | None = None
+        self._infra_check: asyncio.Task | None = None
+        self._infra_checked_at = 0.0
 
     def set_proxy(self, proxy: str):
         self.stop()
@@ -107,26 +329,404 @@ class XManager:
 
     async def active(self, on_run_out_of_proxies=None):
         self.is_active = True
-        await self.x_parser.load_accounts(on_run_out_of_proxies)
-        await self.work()
+        sync = None
+        if await self.x_parser.has_usable_account():
+            # Polling starts on the accounts kept from the last run, accounts.txt is synced alongside
+            sync = asyncio.create_task(self.x_parser.load_accounts(on_run_out_of_proxies))
+        else:
+            await self.x_parser.load_accounts(on_run_out_of_proxies)
+        startup.mark("accounts usable")
+        try:
+            await self.work(sync_accounts=False)
+        finally:
+            if sync is not None:
+                sync.cancel()
 
     async def stop(self):
         self.is_active = False
 
-    async def work(self):
-        while self.is_active:
-            for user_id in existing_user_ids():
-                tweets = await self.x_parser.get_tweets(user_id)
-                new_tweets = filter_new_tweets(tweets)
-                save_new_tweets([t.id for t in new_tweets])
-                if self.on_new_tweet_cb:
-                    await self.on_new_tweet_cb(new_tweets)
+    async def get_concurrency(self) -> int:
+        if self.concurrency > 0:
+            return self.concurrency
+        return await self.x_parser.usable_slots()
+
+    async def poll_user(self, user_id, semaphore: asyncio.Semaphore) -> list[Tweet] | None:
+        """Fetch, dedup and deliver one user's tweets. Returns what was fetched, None on failure."""
+        # Only the fetch holds a slot, sending notifications must not block other users
+        since_id = get_poll_state(user_id).get("last_tweet_id")
+        # A burst is followed back page by page, each page waiting for its token: give
+        # the walk the per-request timeout for each page, plus one for a user lookup
+        pages = math.ceil(MAX_TWEETS_PER_POLL / TIMELINE_PAGE_SIZE) + 1
+        async with semaphore:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                tweets = await asyncio.wait_for(
+                    self.x_parser.get_tweets(user_id, since_id, budget=self.budget),
+                    self.user_timeout_sec * pages,
+                )
+                outcome = "ok"
+            except EmptyTimeline as e:
+                # The only failure that is the user's own
+                logging.warning(f"Fetching tweets of {user_id} failed: {e}")
+                FETCH_ERRORS.inc(reason="unreadable")
+                self.breakers.failure(user_id, str(e))
+                return None
+            except asyncio.TimeoutError:
+                # Accounts, proxies or X itself; a user's breaker must not open for that
+                logging.warning(f"Fetching tweets of {user_id} timed out")
+                FETCH_ERRORS.inc(reason="timeout")
+                outcome = "timeout"
+                self.check_infrastructure()
+                return None
+            except Exception as e:
+                logging.warning(f"Fetching tweets of {user_id} failed: {e}")
+                FETCH_ERRORS.inc(reason=type(e).__name__)
+                self.check_infrastructure()
+                return None
+            finally:
+                FETCH_SECONDS.observe(time.perf_counter() - started, kind="user", outcome=outcome)
+        self.breakers.success(user_id)
+
+        fetched = tweets
+        self.mark_newest(user_id, since_id, tweets)
+        if since_id is None:
+            # First poll of this user only sets the mark, older tweets are not news
+            tweets = [t for t in tweets if t.date.date() >= date.today()]
+        await self.deliver(user_id, tweets)
+        return fetched
+
+    def check_infrastructure(self):
+        """Re-check accounts and proxies in the background, at most once per INFRA_CHECK_EVERY_SEC."""
+        now = time.monotonic()
+        if (self._infra_check is not None and not self._infra_check.done()) or (
+            now - self._infra_checked_at < INFRA_CHECK_EVERY_SEC
+        ):
+            return
+        self._infra_checked_at = now
+        self._infra_check = asyncio.create_task(self.x_parser.check_infrastructure())
+        self._infra_check.add_done_callback(self._infra_checked)
+
+    @staticmethod
+    def _infra_checked(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"Checking accounts and proxies failed: {task.exception()!r}")
+
+    def mark_newest(self, user_id, since_id: int | None, tweets: list[Tweet]):
+        if tweets:
+            newest_id = max(t.id for t in tweets)
+            if since_id is None or newest_id > since_id:
+                update_poll_state(user_id, last_tweet_id=newest_id)
+
+    async def deliver(self, user_id, tweets: list[Tweet]):
+        """Dedup `tweets` and hand the new ones to `on_new_tweet_cb`."""
+        new_tweets = filter_new_tweets(user_id, tweets)
+        if not new_tweets:
+            return
+        save_new_tweets(user_id, [t.id for t in new_tweets])
+        if self.on_new_tweet_cb:
+            try:
+                await self.on_new_tweet_cb(user_id, new_tweets)
+            except Exception as e:
+                logging.warning(f"Delivering tweets of {user_id} failed: {e}")
+
+    async def refresh(self, sync_accounts: bool = True):
+        """Resize the request budget to the usable accounts and pick up user changes."""
+        if sync_accounts:
+            # Moves accounts off proxies the pool has since found unhealthy
+            await self.x_parser.load_accounts()
+        if self.x_parser.archive is not None:
+            self.x_parser.archive.flush_if_due()
+        self.slots = await self.x_parser.usable_slots()
+        self.request_rate = self.slots * self.requests_per_account_window / RATE_LIMIT_WINDOW_SEC
+        self.split_budget()
+        user_ids = existing_user_ids()
+        if self.user_filter:
+            user_ids = [user_id for user_id in user_ids if self.user_filter(user_id)]
+        if self.lists is not None:
+            self.sync_lists(user_ids)
+            members = self.lists.members()
+            user_ids = [
+                user_id
+                for user_id in user_ids
+                if int(user_id) in self.list_fallback
+                or not self.lists.handles(members.get(int(user_id)), self.last_polled.get(user_id, 0))
+            ]
+        # Users new to this worker bring their breakers along, another worker may have opened them
+        self.breakers.reload(set(user_ids) - set(self.scheduler.user_ids()))
+        self.scheduler.sync(user_ids)
+        # Users no longer polled here may be polled by another worker, their saved breakers stay
+        self.breakers.forget(self.breakers.breakers.keys() - {str(user_id) for user_id in user_ids})
+        OVERDUE_USERS.set(self.scheduler.due_count())
+
+    def split_budget(self):
+        backfill_rate = self.request_rate * self.backfill_share if self.backfilling else 0
+        self.budget.set_rate(self.request_rate - backfill_rate, capacity=max(self.slots, 1))
+        if backfill_rate:
+            self.backfill_budget.set_rate(backfill_rate, capacity=max(self.slots * self.backfill_share, 1))
+
+    def finish_poll(self, user_id, tweets: list[Tweet] | None):
+        """Learn from a poll's tweets and put the user back on the schedule."""
+        state = get_poll_state(user_id)
+        updates = learn_posting_rate(state, tweets or [])
+        if "first_polled_at" not in state:
+            updates["first_polled_at"] = time.time()
+        if updates:
+            update_poll_state(user_id, **updates)
+        self.scheduler.finish(user_id, {**state, **updates})
+        self.last_polled[user_id] = time.time()
+        if tweets is not None:
+            self.list_fallback.discard(int(user_id))
+        self.polls_done += 1
+        POLLS_TOTAL.inc()
+        startup.mark("first poll")
+
+    async def poll_scheduled(self, user_id):
+        tweets = None
+        try:
+            tweets = await self.poll_user(user_id, self.semaphore)
+        finally:
+            self.finish_poll(user_id, tweets)
+
+    async def backfill_user(
+        self, user_id, since_id: int, not_before: float, semaphore: asyncio.Semaphore
+    ) -> list[Tweet] | None:
+        # A deep walk is many requests, give it the per-request timeout for each page
+        # and a user lookup
+        pages = math.ceil(self.backfill_max_tweets / TIMELINE_PAGE_SIZE) + 1
+        async with semaphore:
+            await self.backfill_budget.acquire()
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                tweets = await asyncio.wait_for(
+                    self.x_parser.get_tweets(
+                        user_id,
+                        since_id,
+                        max_tweets=self.backfill_max_tweets,
+                        not_before=not_before,
+                        budget=self.backfill_budget,
+                    ),
+                    self.user_timeout_sec * pages,
+                )
+                outcome = "ok"
+            except Exception as e:
+                logging.warning(f"Backfilling tweets of {user_id} failed: {e!r}")
+                FETCH_ERRORS.inc(reason="backfill")
+                return None
+            finally:
+                FETCH_SECONDS.observe(time.perf_counter() - started, kind="backfill", outcome=outcome)
+        return tweets
+
+    async def backfill(self):
+        """
+        Catch up on tweets posted while the bot was not polling.
+
+        Every user polled before is walked back to their last seen tweet, or to
+        `backfill_horizon_sec` ago if that is nearer. Those users are taken off
+        the schedule until they are caught up, so live polling of everyone else
+        goes on meanwhile with the rest of the request budget. Users are fetched
+        in waves of BACKFILL_WAVE_SIZE and each wave is delivered oldest tweet first.
+        """
+        if self.backfill_horizon_sec <= 0:
+            return
+        since_ids = {}
+        for user_id in self.scheduler.user_ids():
+            since_id = get_poll_state(user_id).get("last_tweet_id")
+            if since_id and self.scheduler.start(user_id):
+                since_ids[user_id] = since_id
+        if not since_ids:
+            return
+
+        not_before = time.time() - self.backfill_horizon_sec
+        logging.info(f"Backfilling {len(since_ids)} users")
+        started = time.perf_counter()
+        delivered = 0
+        pending = list(since_ids)
+        unfinished = set(since_ids)
+        self.backfilling = True
+        self.split_budget()
+        try:
+            while pending:
+                wave, pending = pending[:BACKFILL_WAVE_SIZE], pending[BACKFILL_WAVE_SIZE:]
+                semaphore = asyncio.Semaphore(max(int(self.slots * self.backfill_share), 1))
+                results = await asyncio.gather(
+                    *(
+                        self.backfill_user(user_id, since_ids[user_id], not_before, semaphore)
+                        for user_id in wave
+                    )
+                )
+                fetched = dict(zip(wave, results))
+                for user_id, tweets in fetched.items():
+                    self.mark_newest(user_id, since_ids[user_id], tweets or [])
+
+                timeline = sorted(
+                    ((user_id, tweet) for user_id, tweets in fetched.items() for tweet in tweets or []),
+                    key=lambda item: item[1].date,
+                )
+                for user_id, run in itertools.groupby(timeline, key=lambda item: item[0]):
+                    tweets = [tweet for _, tweet in run]
+                    await self.deliver(user_id, tweets)
+                    delivered += len(tweets)
+                for user_id, tweets in fetched.items():
+                    self.finish_poll(user_id, tweets)
+                    unfinished.discard(user_id)
+        finally:
+            # Cancelled midway: whoever was not caught up goes back to live polling
+            for user_id in unfinished:
+                self.scheduler.finish(user_id, get_poll_state(user_id))
+            self.backfilling = False
+            self.split_budget()
+        logging.info(
+            f"Backfilled {len(since_ids)} users in {time.perf_counter() - started:.2f}s, "
+            f"{delivered} tweets"
+        )
+
+    def sync_lists(self, user_ids: list | None = None):
+        """Start syncing X List membership in the background, unless a sync is running."""
+        if self.lists is None or (self._list_sync is not None and not self._list_sync.done()):
+            return
+        if user_ids is None:
+            user_ids = existing_user_ids()
+        self._list_sync = asyncio.create_task(self.lists.sync(user_ids))
+
+    async def poll_list(self, list_id: int):
+        """Fetch a List timeline and deliver its tweets to the members who posted them."""
+        since_id = self.lists.get_since_id(list_id)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            tweets, complete = await asyncio.wait_for(
+                self.lists.get_tweets(list_id, since_id, self.list_max_tweets), self.user_timeout_sec
+            )
+            outcome = "ok"
+        except Exception as e:
+            logging.warning(f"Fetching list {list_id} failed: {e!r}")
+            FETCH_ERRORS.inc(reason="list")
+            return
+        finally:
+            FETCH_SECONDS.observe(time.perf_counter() - started, kind="list", outcome=outcome)
+        # Pages after the first were requests too
+        for _ in range(len(tweets) // LIST_PAGE_SIZE):
+            await self.budget.acquire()
+        if not tweets:
+            return
+        self.x_parser.keep(tweets)
+        self.lists.set_since_id(list_id, tweets[-1].id)
+
+        members = self.lists.members()
+        if not complete:
+            self.fall_back_to_users(list_id, members)
+        by_user: dict = {}
+        for tweet in tweets:
+            # Members polled on their own get these tweets from their own timeline
+            if tweet.user.id in members and tweet.user.id not in self.list_fallback:
+                by_user.setdefault(tweet.user.id, []).append(tweet)
+        timeline = []
+        for user_id, user_tweets in by_user.items():
+            state = get_poll_state(user_id)
+            since = state.get("last_tweet_id")
+            self.mark_newest(user_id, since, user_tweets)
+            updates = learn_posting_rate(state, user_tweets)
+            if updates:
+                update_poll_state(user_id, **updates)
+            if since is None:
+                user_tweets = [t for t in user_tweets if t.date.date() >= date.today()]
+            timeline += [(user_id, t) for t in user_tweets if since is None or t.id > since]
+
+        timeline.sort(key=lambda item: item[1].id)
+        for user_id, run in itertools.groupby(timeline, key=lambda item: item[0]):
+            await self.deliver(user_id, [tweet for _, tweet in run])
+
+    def fall_back_to_users(self, list_id: int, members: dict):
+        """Poll the members of `list_id` on their own once, its walk did not get back to the last one."""
+        in_list = {user_id for user_id, member in members.items() if member["list_id"] == list_id}
+        user_ids = [
+            user_id
+            for user_id in existing_user_ids()
+            if int(user_id) in in_list and (not self.user_filter or self.user_filter(user_id))
+        ]
+        logging.warning(
+            f"List {list_id} had more than {self.list_max_tweets} new tweets, "
+            f"polling its {len(user_ids)} members on their own to cover the rest"
+        )
+        FETCH_ERRORS.inc(reason="list_gap")
+        self.list_fallback.update(int(user_id) for user_id in user_ids)
+        self.scheduler.sync(self.scheduler.user_ids() + user_ids)
+
+    async def poll_lists(self):
+        """Walk every List timeline once per `interval_sec`, within the request budget."""
+        while True:
+            started = time.monotonic()
+            for list_id in self.lists.lists:
+                await self.budget.acquire()
+                await self.poll_list(list_id)
+            await asyncio.sleep(max(self.interval_sec - (time.monotonic() - started), 0))
+
+    async def work(self, sync_accounts: bool = True):
+        """
+        Poll each user when the scheduler says it is due, within the request budget.
+
+        Without `sync_accounts` the first refresh skips the account sync, for
+        callers that just did it.
+        """
+        self.semaphore = asyncio.Semaphore(await self.get_concurrency())
+        tasks = set()
+        next_refresh = 0
+        try:
+            while self.is_active:
+                now = time.monotonic()
+                if now >= next_refresh:
+                    await self.refresh(sync_accounts=sync_accounts or bool(next_refresh))
+                    if not next_refresh:
+                        task = asyncio.create_task(self.backfill())
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        if self.lists is not None and self.lists.lists:
+                            task = asyncio.create_task(self.poll_lists())
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+                    if next_refresh:
+                        logging.info(
+                            f"Polled {self.polls_done} users in {REFRESH_EVERY_SEC}s, "
+                            f"{len(self.scheduler)} tracked, {self.scheduler.due_count()} overdue, "
+                            f"budget {self.budget.rate * 60:.1f} req/min"
+                        )
+                    self.polls_done = 0
+                    next_refresh = now + REFRESH_EVERY_SEC
+
+                user_id, wait = self.scheduler.peek()
+                if wait > 0:
+                    await asyncio.sleep(min(wait, next_refresh - now, self.interval_sec))
+                    continue
+                if self.user_filter and not self.user_filter(user_id):
+                    # Moved to another worker since the last refresh
+                    self.scheduler.remove(user_id)
+                    continue
+                if not self.breakers.allow(user_id):
+                    self.scheduler.postpone(user_id, self.breakers.retry_in(user_id))
+                    continue
+                waited = time.monotonic()
+                await self.budget.acquire()
+                if not self.scheduler.start(user_id):
+                    continue
+                # Overdue at peek time plus the wait for a request token
+                POLL_LAG.observe(max(-wait, 0) + time.monotonic() - waited)
 
-            await asyncio.sleep(self.interval_sec)
+                task = asyncio.create_task(self.poll_scheduled(user_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # Also runs when the task is cancelled, in-flight polls must not outlive it
+            for task in list(tasks):
+                task.cancel()
+            if self._infra_check is not None:
+                self._infra_check.cancel()
 
 
 async def main():
     x_parser = XParser()
+    await x_parser.proxy_pool.probe(list(x_parser.proxy_pool.stats))
     await x_parser.load_accounts()
     resp = await x_parser.get_tweets("1499077769740886018", limit=2)
     pprint(resp)
@@ -1,6 +1,27 @@
+import argparse
 import asyncio
 
 # from bot.x_parser import main
-from bot.proxy import main
+from bot.proxy import check_proxies_stream, main
 
-asyncio.run(main())
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Check proxies")
+parser.add_argument("--stream", action="store_true", help="Check a large list with bounded memory")
+parser.add_argument("--input", default="proxies.txt")
+parser.add_argument("--csv", default="proxy_results.csv")
+parser.add_argument("--txt", default=None, help="Append working proxies to this file")
+parser.add_argument("--workers", type=int, default=100)
+parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping checked proxies")
+args = parser.parse_args()
+
+if args.stream:
+    asyncio.run(
+        check_proxies_stream(
+            args.input,
+            args.csv,
+            args.txt,
+            workers=args.workers,
+            resume=not args.no_resume,
+        )
+    )
+else:
+    asyncio.run(main())